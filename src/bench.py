@@ -0,0 +1,248 @@
+"""
+Benchmarks LERAD on synthetic datasets.
+
+Each dataset is generated in the attribute/training/testing file format,
+then every phase of learning and scoring is timed on its own: parsing,
+pair sampling, candidate generation, the coverage test, training pass 2,
+validation and scoring.  The timings are written as JSON, so runs before
+and after a change can be compared phase by phase.
+
+The attributes come in groups.  The first attribute of a group is drawn
+at random, and each of the others copies a fixed mapping of the one
+before it with probability C (the correlation), so the rules have
+something to find.  Anomalies (the 'attack' cases of the testing file)
+draw every attribute at random.
+"""
+import getopt
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import lerad
+
+#
+# Timed phases, in order.
+#
+PHASES = ['parse', 'sample', 'generate', 'coverage', 'pass2', 'validate', 'score']
+
+def main():
+    """Main execution method."""
+    opts = {'d': None,
+            'o': "../results/bench.json",
+            'A': "20",
+            'K': "8",
+            'R': "10000",
+            'G': "4",
+            'C': ".9",
+            'X': ".05",
+            'S': "100",
+            'L': "1000",
+            'M': "4",
+            'P': ".1",
+            }
+    
+    try:
+        found, _ = getopt.getopt(sys.argv[1:], "d:o:A:K:R:G:C:X:S:L:M:P:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    
+    for o, a in found:
+        opts[o[1]] = a
+    
+    # Without -d, the datasets go to a temporary directory that is
+    #  removed afterwards.
+    directory = opts['d']
+    if directory == None:
+        directory = tempfile.mkdtemp(prefix="bench-")
+    elif not os.path.isdir(directory):
+        os.makedirs(directory)
+    
+    runs = []
+    
+    try:
+        # Every combination of the listed sizes.
+        for attrs in [int(x) for x in opts['A'].split(",")]:
+            for values in [int(x) for x in opts['K'].split(",")]:
+                for rows in [int(x) for x in opts['R'].split(",")]:
+                    config = {'attrs': attrs,
+                              'values': values,
+                              'rows': rows,
+                              'group': int(opts['G']),
+                              'correlation': float(opts['C']),
+                              'anomalies': float(opts['X']),
+                              'S': int(opts['S']),
+                              'L': int(opts['L']),
+                              'M': int(opts['M']),
+                              'P': float(opts['P']),
+                              'seed': 23,
+                              }
+                    
+                    prefix = os.path.join(directory, str(attrs) + "-" + str(values) + "-" + str(rows))
+                    generate(prefix, config)
+                    
+                    result = run(prefix, config)
+                    runs.append(result)
+                    
+                    print(prefix + "\t" + "\t".join([phase + "=" + str(round(result['times'][phase], 3)) for phase in PHASES]))
+        
+    finally:
+        if opts['d'] == None:
+            shutil.rmtree(directory)
+    
+    f = open(opts['o'], 'w')
+    json.dump({'runs': runs}, f, indent=1)
+    f.write("\n")
+    f.close()
+
+def case(rnd, config, maps, normal):
+    """
+    Returns the values (indices) of one synthetic case.
+    
+    Key arguments:
+    rnd    -- the random generator.
+    config -- the dataset configuration (see generate()).
+    maps   -- the mapping each attribute copies from the one before it.
+    normal -- whether the case is normal (correlated) or an anomaly.
+    """
+    ret = []
+    
+    for attr in range(config['attrs']):
+        if normal and attr % config['group'] != 0 and rnd.random() < config['correlation']:
+            ret.append(maps[attr][ret[-1]])
+        else:
+            ret.append(rnd.randrange(config['values']))
+    
+    return ret
+
+def generate(prefix, config):
+    """
+    Writes a synthetic attribute file (prefix-attr.txt), training file
+    (prefix-train.txt, normal cases without the class attribute) and
+    testing file (prefix-test.txt, with the class attribute).
+    
+    Key arguments:
+    prefix -- the start of the file locations.
+    config -- dictionary of the number of attributes (attrs), values per
+              attribute (values), training cases (rows), attributes per
+              correlated group (group), correlation, the share of
+              anomalies in the testing file (anomalies) and the random
+              seed (seed).
+    """
+    rnd = random.Random(config['seed'])
+    
+    maps = []
+    for attr in range(config['attrs']):
+        mapping = list(range(config['values']))
+        rnd.shuffle(mapping)
+        maps.append(mapping)
+    
+    names = ["v" + str(v) for v in range(config['values'])]
+    
+    f = open(prefix + "-attr.txt", 'w')
+    for attr in range(config['attrs']):
+        f.write("a" + str(attr) + " " + " ".join(names) + "\n")
+    f.write("class normal attack\n")
+    f.close()
+    
+    f = open(prefix + "-train.txt", 'w')
+    for i in range(config['rows']):
+        f.write(" ".join([names[v] for v in case(rnd, config, maps, True)]) + "\n")
+    f.close()
+    
+    # The testing file is a tenth of the size of the training file.
+    f = open(prefix + "-test.txt", 'w')
+    for i in range(max(1, config['rows'] // 10)):
+        normal = rnd.random() >= config['anomalies']
+        if normal:
+            label = "normal"
+        else:
+            label = "attack"
+        f.write(" ".join([names[v] for v in case(rnd, config, maps, normal)] + [label]) + "\n")
+    f.close()
+
+def run(prefix, config):
+    """
+    Learns a model from a synthetic training file and scores the testing
+    file, timing each phase.
+    
+    The phases are timed by a lerad.Profile (without tracing allocations)
+    while lerad.learn() and lerad.scores() run as they do in lerad.py
+    (with one process).
+    
+    Returns the configuration along with the time of each phase (times),
+    the number of rules left after each phase of learning (rules) and the
+    area under the ROC curve (auc).
+    
+    Key arguments:
+    prefix -- the start of the file locations (see generate()).
+    config -- the dataset configuration (see generate()).
+    """
+    meta = lerad.meta
+    
+    f = open(prefix + "-attr.txt", 'r')
+    meta['attrs'], meta['values'] = lerad.attrs(f)
+    f.close()
+    meta['codes'] = lerad.codes(meta['values'])
+    
+    meta['opts'] = {'S': config['S'], 'L': config['L'], 'M': config['M'], 'P': config['P'], 'N': "class", 'V': "normal"}
+    
+    random.seed(config['seed'])
+    
+    profile = lerad.Profile(False)
+    lerad.profile = profile
+    try:
+        profile.start('parse')
+        cases = lerad.scan(prefix + "-train.txt")
+        test = lerad.scan(prefix + "-test.txt")
+        
+        found = lerad.learn(cases)
+        
+        values, _, _ = lerad.scores(test, found)
+        profile.stop()
+    finally:
+        lerad.profile = None
+    
+    _, auc = lerad.curve(test, values)
+    
+    times = {}
+    for phase in PHASES:
+        times[phase] = profile.phases.get(phase, {'time': 0.0})['time']
+    
+    rules = {}
+    rules['generate'] = profile.counters.get('generated', 0)
+    rules['coverage'] = rules['generate'] - profile.counters.get('covered', 0)
+    rules['validate'] = len(found)
+    
+    result = dict(config)
+    result['times'] = times
+    result['rules'] = rules
+    result['auc'] = auc
+    
+    return result
+
+def usage():
+    """Prints the usage of the program."""
+    print("\n" +
+          "The following arguments are optional:\n" +
+          "-d: the directory to keep the synthetic datasets in (by default\n" +
+          "    they are written to a temporary directory and removed).\n" +
+          "-o: the JSON results file.\n" +
+          "-A: the number of attributes (a comma separated list to run each).\n" +
+          "-K: the number of values per attribute (a list, as for -A).\n" +
+          "-R: the number of training cases (a list, as for -A).\n" +
+          "-G: the number of attributes in a correlated group.\n" +
+          "-C: the chance an attribute follows the one before it.\n" +
+          "-X: the share of anomalies in the testing file.\n" +
+          "-S, -L, -M, -P: the learning options of lerad.py.\n" +
+          "\n" +
+          "Example Usage:\n" +
+          "python bench.py -R 10000,100000 -A 20 -K 8 -o \"../results/bench.json\"" +
+          "\n")
+
+"""Main execution."""
+if __name__ == "__main__":
+    main()
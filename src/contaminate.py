@@ -0,0 +1,192 @@
+"""
+Writes contaminated training files for the robustness study.
+
+Each file is the clean training file with attacks from an attack file
+mixed in, R percent of the number of training cases for a rate R.  The
+attacks are drawn from the attack file with replacement, and go in at
+random rows, so every order of the training cases and attacks is as
+likely.
+
+The rows of the attacks are drawn and sorted before anything is written,
+then the training file is read once, a block of cases at a time, and
+each block is written to every file with the attacks that go before its
+rows.  Only the attack file and the attack rows (as arrays, 12 bytes an
+attack) are held in memory.
+
+The draws of each file only depend on the seed and its rate, so a file
+is the same whatever other rates are written with it.
+"""
+import array
+import fractions
+import getopt
+import heapq
+import itertools
+import random
+import re
+import sys
+
+#
+# Most training cases copied at a time.
+#
+CHUNK = 10000
+
+#
+# Set bits of each byte value, lowest first (see draw()).
+#
+BITS = [[bit for bit in range(8) if (value >> bit) & 1] for value in range(256)]
+
+def main():
+    """Main execution method."""
+    opts = {'t': "../data/ids-train.txt",
+            'a': "../data/ids-attack.txt",
+            'r': "0,1,2,3,4,5,6,7,8,9,10",
+            'o': "../data/robust/train-",
+            's': "23",
+            }
+    
+    try:
+        found, _ = getopt.getopt(sys.argv[1:], "t:a:r:o:s:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    
+    for o, a in found:
+        opts[o[1]] = a
+    
+    try:
+        contaminate(opts['t'], opts['a'], opts['r'].split(","), opts['o'], int(opts['s']))
+    except ValueError as e:
+        print(str(e))
+        sys.exit(2)
+
+def contaminate(train, attack, rates, prefix, seed):
+    """
+    Writes a contaminated copy of a training file for each rate, to the
+    prefix followed by the rate and ".txt".
+    
+    Key arguments:
+    train  -- the training file location.
+    attack -- the attack file location.
+    rates  -- the percents of attacks (strings, such as "5" or "0.5").
+    prefix -- the start of the file locations.
+    seed   -- the random seed.
+    """
+    f = open(attack, 'rb')
+    attacks = [line.rstrip(b"\r\n") + b"\n" for line in f if line.strip()]
+    f.close()
+    
+    # Count the training cases.
+    f = open(train, 'rb')
+    length = 0
+    for line in f:
+        length += 1
+    f.close()
+    
+    if not attacks and any(fractions.Fraction(rate) > 0 for rate in rates):
+        raise ValueError("Attack file '" + attack + "' has no attacks.")
+    
+    # For each file, the training rows the attacks go before, in order (a
+    #  row of length is past the last training case), and the attacks.
+    befores = []
+    for rate in rates:
+        if fractions.Fraction(rate) < 0:
+            raise ValueError("Rate '" + rate + "' is negative.")
+        
+        # Exact, so the rates don't drift.
+        count = int(fractions.Fraction(rate) * length / 100)
+        
+        rnd = random.Random(str(seed) + ":" + rate)
+        rows = draw(rnd, length + count, count)
+        
+        # The t-th attack in the file has t attacks before it.
+        for t in range(count):
+            rows[t] -= t
+        
+        chosen = array.array('I', rnd.choices(range(len(attacks)), k=count))
+        
+        befores.append((rows, chosen))
+    
+    outs = [open(prefix + rate + ".txt", 'wb') for rate in rates]
+    
+    # Next attack of each file.
+    nexts = [0] * len(rates)
+    
+    # Rows that have attacks before them, in order (with repeats).
+    stops = heapq.merge(*[rows for rows, _ in befores])
+    
+    f = open(train, 'rb')
+    
+    row = 0
+    for stop in itertools.chain(stops, [length]):
+        # Copy the training cases up to the stop.
+        while row < stop:
+            block = list(itertools.islice(f, min(CHUNK, stop - row)))
+            if not block:
+                break
+            
+            raw = b"".join(block)
+            if not raw.endswith(b"\n"):
+                raw += b"\n"
+            
+            for out in outs:
+                out.write(raw)
+            
+            row += len(block)
+        
+        # Then the attacks that go before it (none on a repeat).
+        for i, (rows, chosen) in enumerate(befores):
+            while nexts[i] < len(rows) and rows[nexts[i]] == stop:
+                outs[i].write(attacks[chosen[nexts[i]]])
+                nexts[i] += 1
+    
+    f.close()
+    
+    for out in outs:
+        out.close()
+
+def draw(rnd, size, count):
+    """
+    Returns (count) distinct random rows below (size), in order.
+    
+    Each row is marked in a bitmap of (size) bits as it is drawn, and the
+    rows are read back from the bitmap in order, so neither a set nor a
+    list of them is made.
+    
+    Key arguments:
+    rnd   -- the random generator.
+    size  -- the number of rows.
+    count -- the number of rows to draw.
+    """
+    marks = bytearray((size + 7) // 8)
+    
+    drawn = 0
+    while drawn < count:
+        row = rnd.randrange(size)
+        if not (marks[row >> 3] >> (row & 7)) & 1:
+            marks[row >> 3] |= 1 << (row & 7)
+            drawn += 1
+    
+    rows = array.array('Q')
+    for found in re.finditer(b"[^\x00]", marks):
+        i = found.start()
+        rows.extend([i * 8 + bit for bit in BITS[marks[i]]])
+    
+    return rows
+
+def usage():
+    """Prints the usage of the program."""
+    print("\n" +
+          "The following arguments are optional:\n" +
+          "-t: the training file location.\n" +
+          "-a: the attack file location.\n" +
+          "-r: the percents of attacks, a comma separated list to write each.\n" +
+          "-o: the start of the contaminated file locations (followed by the rate and .txt).\n" +
+          "-s: the random seed.\n" +
+          "\n" +
+          "Example Usage:\n" +
+          "python contaminate.py -t \"../data/ids-train.txt\" -a \"../data/ids-attack.txt\" -r 0,1,2,5,10 -o \"../data/robust/train-\"" +
+          "\n")
+
+"""Main execution."""
+if __name__ == "__main__":
+    main()
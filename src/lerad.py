@@ -16,9 +16,26 @@ The style guide follows the strict python PEP 8 guidelines.
 @course CSE 5800 Advanced Topics in CS: Learning/Mining and the Internet, Fall 2011
 @project Proj 02, LERAD
 """
+import array
+import ast
+import collections
 import getopt
+import hashlib
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import operator
+import os
 import random
+import selectors
+import socket
+import struct
 import sys
+import tempfile
+import time
+import tracemalloc
 
 #
 # Set the random seed to keep the numbers the same per trial.
@@ -34,8 +51,102 @@ meta = {
         # The attribute dictionary contains all the attributes found in the
         #  attribute file.
         'attrs': {},
+        # The values dictionary contains the legal values of each attribute,
+        #  in the order they are listed in the attribute file.
+        'values': {},
+        # The codes dictionary maps each attribute's values to their codes.
+        'codes': {},
         }
 
+#
+# Code for a cell whose attribute is absent from a case (e.g. the class
+#  attribute in a training file).  Legal values are coded from 1 upwards,
+#  and values that are not listed one past the last (see unseen()).
+#
+MISSING = 0
+
+#
+# Bytes of (attribute, value) masks a Dataset keeps (a mask costs a byte
+#  per case).  Past this, the least recently used masks are dropped and
+#  made again when they are needed.
+#
+MASKS = 1 << 24
+
+#
+# A rule's bindings are found from the postings of its rarest antecedent
+#  term, rather than from masks of every case, when at most one in SPARSE
+#  of the cases has that term (see bindings()).
+#
+SPARSE = 32
+
+#
+# Bytes of a training/testing file encoded at a time by scan() (each block
+#  ends at a line break, so blocks are a little longer).  A block is split
+#  into a bytes object per value while it is encoded, which takes about 20
+#  times its size, so blocks are kept small.
+#
+BLOCK = 1 << 18
+
+#
+# Binary model file header: magic, version, words per consequent set,
+#  number of rules, number of antecedent terms (little-endian) and the
+#  digest of the attribute values the codes stand for (see vocabulary()).
+#  Version 1 and 2 files end the header before the digest.
+#
+HEADER = struct.Struct("<4sHHII32s")
+OLD_HEADER = struct.Struct("<4sHHII")
+MAGIC = b"LERD"
+VERSION = 3
+
+#
+# Typecodes of the binary model file sections, in file order: antecedent
+#  offsets, antecedent attributes, antecedent codes, consequent attributes,
+#  bindings, consequent sets and (from version 2) the number of training
+#  cases with each antecedent term.
+#
+SECTIONS = ['I', 'H', 'I', 'H', 'Q', 'Q', 'Q']
+
+#
+# Cache file header (for the encoded cases of a training/testing file):
+#  magic, version, number of attributes, number of cases, size and
+#  modification time (ns) of the training/testing file, and SHA-256
+#  digests of its contents and of the attribute values (little-endian).
+#  The code array of each attribute follows, 8 byte aligned.
+#
+CACHE_HEADER = struct.Struct("<4sHHQQq32s32s")
+CACHE_MAGIC = b"LRDC"
+CACHE_VERSION = 1
+
+#
+# Cases read at a time during the 'update' phase, unless -C is given.
+#
+CHUNK = 10000
+
+#
+# Latencies kept for the percentiles reported by the 'serve' phase.
+#
+LATENCIES = 100000
+
+#
+# Longest line (in bytes) the 'serve' phase waits on.  A client that sends
+#  more than this without a line break is answered with an error and
+#  disconnected.
+#
+PENDING = 1 << 20
+
+#
+# The Profile of the run when -I is given, otherwise None so that the
+#  phases and counters cost a single check.
+#
+profile = None
+
+#
+# The bytes to code lookup of each attribute used by scan_block(), with
+#  the codes dictionary it was built from, so it is built once per process
+#  rather than once per block (see encodings()).
+#
+lookups = None
+
 #
 # Classes
 #
@@ -43,16 +154,29 @@ meta = {
 class Rule(object):
     """
     Rule object contains a consequent and an antecedent.
+    
+    The consequent is an attribute and the values of it the rule allows,
+    held as a bitmask of their codes (bit c is set for code c).  The n/r
+    score is cached until the bindings (n) or the values (r) change.
     """
     
     # Antecedent
     antecedent = {}
     
-    # Consequent
-    consequent = (0, [])
+    # Consequent attribute
+    consequent = 0
+    
+    # Consequent values, as a bitmask of their codes
+    allowed = 0
+    
+    # Number of consequent values
+    r = 0
     
     # Number of cases this rule binds to
-    bindings = 0
+    n = 0
+    
+    # n/r score, None until it is calculated
+    cached = None
     
     def __init__(self, rule=None):
         """
@@ -61,6 +185,9 @@ class Rule(object):
         Key arguments:
         rule -- [optional] rule to copy from.
         """
+        # Every rule has its own antecedent.
+        self.antecedent = {}
+        
         if rule == None:
             return
         
@@ -68,12 +195,18 @@ class Rule(object):
         if isinstance(rule, Rule):
             self.antecedent = dict(rule.antecedent)
             self.consequent = rule.consequent
+            self.allowed = rule.allowed
+            self.r = rule.r
             return
         
-        # Builds a rule from a dictionary.
+        # Builds a rule from a saved dictionary, encoding its values.
         if isinstance(rule, dict):
-            self.antecedent = rule['antecedent']
-            self.consequent = rule['consequent']
+            for attr, value in rule['antecedent'].items():
+                self.antecedent[attr] = encode(attr, value)
+            attr = rule['consequent'][0]
+            self.consequent = attr
+            for value in rule['consequent'][1]:
+                self.allow(encode(attr, value))
             self.bindings = rule['bindings']
             return
     
@@ -84,25 +217,73 @@ class Rule(object):
         output = "IF "
         
         for attr, value in self.antecedent.items():
-            output += meta['attrs'][attr] + " = " + value + " AND "
+            output += meta['attrs'][attr] + " = " + decode(attr, value) + " AND "
         
+        attr = self.consequent
         output = output[:-5] + " THEN "
-        output += meta['attrs'][self.consequent[0]] + " = " + ",".join(self.consequent[1])
+        output += meta['attrs'][attr] + " = " + ",".join([decode(attr, value) for value in self.values()])
 
         return output
     
+    @property
+    def bindings(self):
+        """
+        Number of cases this rule binds to (n).
+        """
+        return self.n
+    
+    @bindings.setter
+    def bindings(self, n):
+        self.n = n
+        self.cached = None
+    
+    def allow(self, code):
+        """
+        Adds a value to the rule's consequent values.
+        
+        Key arguments:
+        code -- the value code.
+        """
+        bit = 1 << code
+        if not self.allowed & bit:
+            self.allowed |= bit
+            self.r += 1
+            self.cached = None
+    
+    def allows(self, code):
+        """
+        Determines if a value is one of the rule's consequent values.
+        
+        Key arguments:
+        code -- the value code.
+        """
+        return (self.allowed >> code) & 1 == 1
+    
     def binds(self, case):
         """
-        Determines if a rule binds to a case/rule.
+        Determines if a rule binds to an encoded case.
         
         Key arguments:
         case -- the case to check.
         """
         for attr, value in self.antecedent.items():
-            if not attr in case:
+            if case[attr] != value:
+                return False
+        
+        return True
+    
+    def covers(self, rule):
+        """
+        Determines if a rule's antecedent is contained in another rule's.
+        
+        Key arguments:
+        rule -- the rule to check.
+        """
+        for attr, value in self.antecedent.items():
+            if not attr in rule.antecedent:
                 return False
             
-            if case[attr] != value:
+            if rule.antecedent[attr] != value:
                 return False
         
         return True
@@ -112,303 +293,2818 @@ class Rule(object):
         Returns a str that can be saved to a file.
         """
         rule = {}
-        rule['antecedent'] = self.antecedent
-        rule['consequent'] = self.consequent
+        rule['antecedent'] = {}
+        for attr, value in self.antecedent.items():
+            rule['antecedent'][attr] = decode(attr, value)
+        attr = self.consequent
+        rule['consequent'] = (attr, [decode(attr, value) for value in self.values()])
         rule['bindings'] = self.bindings
         return str(rule)
     
     def score(self):
         """
-        Calculates the n/r score.
+        Returns the n/r score.
         """
-        return self.bindings / float(len(self.consequent[1]))
-#
-# Methods
-#
+        if self.cached == None:
+            self.cached = self.n / float(self.r)
+        
+        return self.cached
+    
+    def values(self):
+        """
+        Returns the codes of the rule's consequent values, in order.
+        """
+        ret = []
+        
+        allowed = self.allowed
+        while allowed:
+            low = allowed & -allowed
+            ret.append(low.bit_length() - 1)
+            allowed ^= low
+        
+        return ret
 
-def attrs(f):
+class RuleSet(object):
+    """
+    RuleSet object holds rules in flat typed arrays.
+    
+    The antecedent of rule r is the attrs/values pairs from offsets[r] up
+    to offsets[r + 1], and its consequent values are the bits set in the
+    width 64-bit words of sets starting at r * width.  The arrays are the
+    sections of the binary model file, so a mapped model file is used
+    in place and shared between processes through the page cache.
+    
+    The counts hold the number of training cases with each antecedent
+    term, which is how selective the term is.  They are all 0 when the
+    training cases are not known.
+    
+    Learning keeps its candidate rules in a RuleSet too, so each one
+    costs a few array items rather than a Rule object.  Rule objects are
+    made one at a time when a rule is needed (see rule() and iteration),
+    and changes are written back with update().
     """
-    Parses an attribute file into an attribute dictionary.
-    
-    Each key in the dictionary (attribute index) contains the
-    attribute name and number possible values for that attribute.
     
-    e.g.:
+    def __init__(self, offsets, attrs, values, consequents, bindings, sets, counts, width):
+        """
+        RuleSet init
+        
+        Key arguments:
+        offsets     -- the start of each rule's antecedent, and the end.
+        attrs       -- the antecedent attributes.
+        values      -- the antecedent value codes.
+        consequents -- the consequent attribute of each rule.
+        bindings    -- the bindings of each rule.
+        sets        -- the consequent value bitsets.
+        counts      -- the training cases with each antecedent term.
+        width       -- the number of words in a bitset.
+        """
+        self.offsets = offsets
+        self.attrs = attrs
+        self.values = values
+        self.consequents = consequents
+        self.bindings = bindings
+        self.sets = sets
+        self.counts = counts
+        self.width = width
+    
+    def __iter__(self):
+        """
+        Yields a Rule object for each rule, in order.
+        """
+        for r in range(len(self)):
+            yield self.rule(r)
     
-        attrs[0] = ('duration', 6)
-        ...
+    def __len__(self):
+        """
+        Returns the number of rules.
+        """
+        return len(self.consequents)
     
-    Key arguments:
-    f -- the attribute file handle.
-    """
-    ret = {}
+    def allows(self, r, code):
+        """
+        Determines if a value is one of a rule's consequent values.
+        
+        Codes past the rule's words (such as the unseen code of a model
+        written with too few words) are never allowed.
+        
+        Key arguments:
+        r    -- the rule index.
+        code -- the value code.
+        """
+        if code >= 64 * self.width:
+            return False
+        
+        return (self.sets[r * self.width + (code >> 6)] >> (code & 63)) & 1 == 1
     
-    i = 0
-    for line in f:
-        # The first item is the attribute name, the rest are possible values.
-        split = line[:-1].split(" ")
-        ret[i] = split[0]
-        i += 1
+    def append(self, rule):
+        """
+        Adds a rule (with no count for its antecedent terms).
+        
+        Key arguments:
+        rule -- the Rule object.
+        """
+        for attr, value in rule.antecedent.items():
+            self.attrs.append(attr)
+            self.values.append(value)
+            self.counts.append(0)
+        self.offsets.append(len(self.attrs))
+        
+        self.consequents.append(rule.consequent)
+        self.bindings.append(rule.bindings)
+        
+        bits = rule.allowed
+        for w in range(self.width):
+            self.sets.append((bits >> (64 * w)) & 0xFFFFFFFFFFFFFFFF)
     
-    return ret
-
-def data(f):
-    """
-    Parses a training/testing file and returns the cases.
+    def count(self, tallies):
+        """
+        Sets the number of training cases with each antecedent term.
+        
+        Key arguments:
+        tallies -- the count of every code of each attribute in the
+                   training cases (see tally()).
+        """
+        self.counts = array.array('Q', [tallies[attr][value] for attr, value in zip(self.attrs, self.values)])
     
-    e.g.:
+    def extend(self, rules):
+        """
+        Adds the rules of another RuleSet.
+        
+        Key arguments:
+        rules -- the RuleSet.
+        """
+        base = len(self.attrs)
+        for offset in rules.offsets[1:]:
+            self.offsets.append(base + offset)
+        
+        self.attrs.extend(rules.attrs)
+        self.values.extend(rules.values)
+        self.consequents.extend(rules.consequents)
+        self.bindings.extend(rules.bindings)
+        self.sets.extend(rules.sets)
+        self.counts.extend(rules.counts)
+    
+    def keep(self, indices):
+        """
+        Reduces the rules to those given, in the order given.
+        
+        The sections become arrays, so the rules of a mapped model file
+        can be changed afterwards.
+        
+        Key arguments:
+        indices -- the indices of the rules to keep.
+        """
+        rules = self.take(indices)
+        
+        self.offsets = rules.offsets
+        self.attrs = rules.attrs
+        self.values = rules.values
+        self.consequents = rules.consequents
+        self.bindings = rules.bindings
+        self.sets = rules.sets
+        self.counts = rules.counts
+    
+    def rule(self, r):
+        """
+        Returns a Rule object for a rule.
+        
+        Key arguments:
+        r -- the rule index.
+        """
+        rule = Rule()
+        
+        rule.antecedent = {}
+        for j in range(self.offsets[r], self.offsets[r + 1]):
+            rule.antecedent[self.attrs[j]] = self.values[j]
+        
+        rule.consequent = self.consequents[r]
+        for w in range(self.width):
+            rule.allowed |= self.sets[r * self.width + w] << (64 * w)
+        rule.r = popcount(rule.allowed)
+        rule.bindings = self.bindings[r]
+        
+        return rule
     
-        cases = [{
-                    'duration': 'zero',
-                    'protocol_type': 'tcp'
-                },
-                ...
-               ]
+    def score(self, r):
+        """
+        Calculates the n/r score of a rule.
+        
+        Key arguments:
+        r -- the rule index.
+        """
+        count = 0
+        for w in range(self.width):
+            count += popcount(self.sets[r * self.width + w])
+        
+        return self.bindings[r] / float(count)
     
-    Key arguments:
-    f  -- the file handle.
-    """
-    # Cases list.
-    ret = []
+    def scores(self):
+        """
+        Returns the n/r score of every rule.
+        """
+        return array.array('d', [self.score(r) for r in range(len(self))])
     
-    for line in f:
-        case = {}
-        i = 0
-        split = line[:-1].split(" ")
-        for value in split:
-            # Set the attribute and the value.
-            case[i] = value
+    def take(self, indices):
+        """
+        Returns a RuleSet of the rules given, in the order given.
+        
+        Key arguments:
+        indices -- the indices of the rules.
+        """
+        width = self.width
+        
+        offsets = array.array('I', [0])
+        attrs = array.array('H')
+        values = array.array('I')
+        consequents = array.array('H')
+        bindings = array.array('Q')
+        sets = array.array('Q')
+        counts = array.array('Q')
+        
+        for r in indices:
+            start = self.offsets[r]
+            end = self.offsets[r + 1]
+            attrs.extend(self.attrs[start:end])
+            values.extend(self.values[start:end])
+            counts.extend(self.counts[start:end])
+            offsets.append(len(attrs))
             
-            i += 1
+            consequents.append(self.consequents[r])
+            bindings.append(self.bindings[r])
+            sets.extend(self.sets[r * width:(r + 1) * width])
         
-        # Append the case.
-        ret.append(case)
+        return RuleSet(offsets, attrs, values, consequents, bindings, sets, counts, width)
     
-    # Return the cases.
-    return ret
+    def tally(self):
+        """
+        Returns the number of training cases with each antecedent term, in
+        the same form as tally() (only the terms of the rules are known).
+        """
+        tallies = []
+        for attr in range(len(meta['attrs'])):
+            tallies.append(collections.Counter())
+        
+        for attr, value, count in zip(self.attrs, self.values, self.counts):
+            tallies[attr][value] = count
+        
+        return tallies
+    
+    def update(self, r, rule):
+        """
+        Stores the bindings and consequent values of a Rule object made by
+        rule() back into a rule.
+        
+        Key arguments:
+        r    -- the rule index.
+        rule -- the Rule object.
+        """
+        self.bindings[r] = rule.bindings
+        
+        bits = rule.allowed
+        for w in range(self.width):
+            self.sets[r * self.width + w] = (bits >> (64 * w)) & 0xFFFFFFFFFFFFFFFF
+    
+    def write(self, f):
+        """
+        Writes the rules to a binary model file.
+        
+        Key arguments:
+        f -- the (binary) file handle.
+        """
+        f.write(HEADER.pack(MAGIC, VERSION, self.width, len(self), len(self.attrs), vocabulary()))
+        
+        for typecode, section in zip(SECTIONS, [self.offsets, self.attrs, self.values, self.consequents, self.bindings, self.sets, self.counts]):
+            section = array.array(typecode, section)
+            if sys.byteorder != 'little':
+                section.byteswap()
+            raw = section.tobytes()
+            
+            # Keep every section 8 byte aligned.
+            f.write(raw + b"\x00" * (-len(raw) % 8))
 
-def learn(cases):
+class Dataset(object):
     """
-    Learns rules based on a given set of training cases.
+    Dataset object contains encoded cases, stored by column.
     
-    Key arguments:
-    cases -- the training cases.
+    Each attribute is an unsigned array of value codes, one per case,
+    so a case costs a byte or two per attribute rather than a dict of
+    strings.  Cases are read back as tuples indexed by attribute.
+    
+    The columns may also be memoryviews of a mapped cache file (see
+    cached()).
+    
+    Masks select a set of cases at once.  A mask is an int holding one
+    byte per case (the first case in the lowest byte), which is 1 if the
+    case is selected and 0 otherwise, so masks combine with & and |.
+    Only the most recently used masks are kept (see MASKS), as a mask
+    costs as much as a column of one byte codes.
+    
+    Postings are the other index of the cases: the sorted indices of the
+    cases with each (attribute, value), so a rare value is found without
+    looking at every case (see bindings()).
     """
-    # Number of validation cases.
-    num = int(meta['opts']['P'] * len(cases))
     
-    # Can't have a training set of 0.
-    if num == len(cases):
-        raise "Training set to small or validation percentage to high."
+    def __init__(self, columns, length):
+        """
+        Dataset init
+        
+        Key arguments:
+        columns -- the code array of each attribute.
+        length  -- the number of cases.
+        """
+        self.columns = columns
+        self.length = length
+        
+        # Cache of the (attribute, value) masks, least recently used first,
+        #  and the mask of all the cases.
+        self.masks = collections.OrderedDict()
+        self.full = None
+        
+        # Cache of each attribute's code counts, and of the (attribute,
+        #  value) postings.
+        self.counts = {}
+        self.lists = {}
     
-    # Make training and validation set.
-    train = cases[num:]
-    validate = cases[:num]
+    def __getstate__(self):
+        """
+        Returns the state to pickle, with mapped columns copied out.
+        """
+        state = dict(self.__dict__)
+        state['columns'] = [array.array(column.format, column) if isinstance(column, memoryview) else column for column in self.columns]
+        return state
     
-    if meta['opts']['S'] > len(train):
-        raise "Desired sample size exceeds training cases provided."
+    def __getitem__(self, key):
+        """
+        Returns a case, or a new dataset for a slice of cases.
+        
+        Key arguments:
+        key -- the case index or slice.
+        """
+        if isinstance(key, slice):
+            columns = [column[key] for column in self.columns]
+            return Dataset(columns, len(range(*key.indices(self.length))))
+        
+        return tuple([column[key] for column in self.columns])
     
-    # Subset is a random sample
-    subset = sample_subset(train, meta['opts']['S'])
+    def __iter__(self):
+        """
+        Iterates over the cases.
+        """
+        return zip(*self.columns)
     
-    rules = []
+    def __len__(self):
+        """
+        Returns the number of cases.
+        """
+        return self.length
     
-    # Linear list of the samples we're going to compare.
-    pairs = sample_pairs(subset, meta['opts']['L'] * 2)
+    def count(self, attr, code):
+        """
+        Returns the number of cases whose attribute has the given code.
+        
+        Key arguments:
+        attr -- the attribute index.
+        code -- the value code.
+        """
+        if not attr in self.counts:
+            self.counts[attr] = collections.Counter(self.columns[attr])
+        
+        return self.counts[attr][code]
     
-    for pair in pairs:
-        for rule in generate_rules(pair[0], pair[1]):
-            # For each rule, if the rule binds to to a case
-            #  we update the consequents if necessary (r) and the
-            #  the number of bindings (n).
-            for case in subset:
-                if rule.binds(case):
-                    # Increase bindings.
-                    rule.bindings += 1
-                    # Check if we need to update consequents.
-                    if not case[rule.consequent[0]] in rule.consequent[1]:
-                        rule.consequent[1].append(case[rule.consequent[0]])
-                    
-            rules.append(rule)
+    def mask(self, attr, code):
+        """
+        Returns the mask of the cases whose attribute has the given code.
+        
+        Key arguments:
+        attr -- the attribute index.
+        code -- the value code.
+        """
+        key = (attr, code)
+        
+        if key in self.masks:
+            self.masks.move_to_end(key)
+        else:
+            column = self.columns[attr]
+            raw = column.tobytes()
+            size = column.itemsize
+            
+            # Compare each byte of the codes separately, so the whole
+            #  column is translated to 0/1 bytes at once.
+            mask = self.ones()
+            for j in range(size):
+                if sys.byteorder == 'little':
+                    shift = 8 * j
+                else:
+                    shift = 8 * (size - 1 - j)
+                
+                table = bytearray(256)
+                table[(code >> shift) & 0xFF] = 1
+                mask &= int.from_bytes(raw[j::size].translate(table), 'little')
+            
+            self.masks[key] = mask
+            
+            # Drop the least recently used masks past the budget.
+            while len(self.masks) > 1 and len(self.masks) * self.length > MASKS:
+                self.masks.popitem(False)
+        
+        return self.masks[key]
     
-    # "Coverage test".
-    remove_rules(rules)
+    def ones(self):
+        """
+        Returns the mask of all the cases.
+        """
+        if self.full == None:
+            self.full = int.from_bytes(b"\x01" * self.length, 'little')
+        
+        return self.full
     
-    # Training pass 2, update the consequents on the remaining
-    #  samples in the training set.
-    remaining = []
-    for case in train:
-        if not case in subset:
-            remaining.append(case)
+    def postings(self, attr, code):
+        """
+        Returns the indices of the cases whose attribute has the given
+        code, in order.
+        
+        Key arguments:
+        attr -- the attribute index.
+        code -- the value code.
+        """
+        key = (attr, code)
+        
+        if not key in self.lists:
+            self.lists[key] = array.array('I', positions(self.mask(attr, code), self.length))
+        
+        return self.lists[key]
+    
+    def take(self, indices):
+        """
+        Returns a new dataset of the cases at the given indices.
+        
+        Key arguments:
+        indices -- the case indices, in the order to take them.
+        """
+        columns = []
+        for column in self.columns:
+            if isinstance(column, memoryview):
+                code = column.format
+            else:
+                code = column.typecode
+            columns.append(array.array(code, [column[i] for i in indices]))
+        
+        return Dataset(columns, len(indices))
+
+class RuleIndex(object):
+    """
+    RuleIndex object maps each (attribute, value) term to the rules whose
+    antecedent contains it.
+    
+    A case only visits the rules that share one of its terms, and a rule
+    binds when all of its terms were visited, so matching a case costs
+    the number of partially matching rules rather than the model size.
+    """
+    
+    def __init__(self, rules):
+        """
+        RuleIndex init
+        
+        Key arguments:
+        rules -- the RuleSet to index.
+        """
+        self.rules = rules
+        
+        # Number of terms each rule needs to bind.
+        self.sizes = []
+        
+        # Rule indices for each attribute, keyed by value.
+        self.terms = {}
+        
+        offsets = rules.offsets
+        for r in range(len(rules)):
+            self.sizes.append(offsets[r + 1] - offsets[r])
+            for j in range(offsets[r], offsets[r + 1]):
+                self.terms.setdefault(rules.attrs[j], {}).setdefault(rules.values[j], []).append(r)
+    
+    def match(self, case):
+        """
+        Returns the indices of the rules that bind to a case, in order.
+        
+        Key arguments:
+        case -- the case to match.
+        """
+        counts = {}
+        
+        for attr, values in self.terms.items():
+            for r in values.get(case[attr], ()):
+                counts[r] = counts.get(r, 0) + 1
+        
+        ret = [r for r, count in counts.items() if count == self.sizes[r]]
+        ret.sort()
+        
+        return ret
+
+class RuleTrie(object):
+    """
+    RuleTrie object arranges the rule antecedents into a trie.
+    
+    Every rule's terms are put in one global order, most selective (the
+    fewest training cases) first, and rules share the nodes of their
+    common leading terms.  A case walks down every branch whose term it
+    has, so one walk finds all the rules that bind to it and each shared
+    term is checked once rather than once per rule.
+    """
+    
+    def __init__(self, rules):
+        """
+        RuleTrie init
+        
+        Key arguments:
+        rules -- the RuleSet to arrange.
+        """
+        self.rules = rules
+        
+        # A node is its children (keyed by attribute, then value) and the
+        #  rules that end at it.
+        self.root = ({}, [])
+        
+        offsets = rules.offsets
+        for r in range(len(rules)):
+            terms = []
+            for j in range(offsets[r], offsets[r + 1]):
+                terms.append((rules.counts[j], rules.attrs[j], rules.values[j]))
+            terms.sort()
+            
+            node = self.root
+            for _, attr, value in terms:
+                values = node[0].setdefault(attr, {})
+                if not value in values:
+                    values[value] = ({}, [])
+                node = values[value]
+            node[1].append(r)
+    
+    def match(self, case):
+        """
+        Returns the indices of the rules that bind to a case, in order.
+        
+        Key arguments:
+        case -- the case to match.
+        """
+        ret = []
+        
+        stack = [self.root]
+        while stack:
+            children, ends = stack.pop()
+            ret.extend(ends)
+            for attr, values in children.items():
+                node = values.get(case[attr])
+                if node != None:
+                    stack.append(node)
+        
+        ret.sort()
+        
+        return ret
+
+class Scorer(object):
+    """
+    Scorer object scores cases one at a time, in order.
+    
+    It only keeps the position of the last case and of each rule's last
+    violation, so a stream of any length is scored in constant memory.
+    Blocks of cases can also be scored at once (see batch()), with the
+    same results.
+    
+    The rules can be several models merged into one RuleSet (see merge()),
+    which share the rule matching and are scored apart (see split()).
+    """
+    
+    def __init__(self, rules, starts=None):
+        """
+        Scorer init
+        
+        Key arguments:
+        rules  -- the rules (or RuleSet) to check against.
+        starts -- [optional] the index of the first rule of each model,
+                  and the number of rules, when the rules are merged.
+        """
+        if not isinstance(rules, RuleSet):
+            rules = ruleset(rules)
+        
+        self.rules = rules
+        
+        if starts == None:
+            starts = [0, len(rules)]
+        self.starts = starts
+        
+        # Rule matching method.
+        if meta['opts'].get('K', 'trie') == 'index':
+            self.index = RuleIndex(rules)
+        else:
+            self.index = RuleTrie(rules)
+        
+        # The n/r of each rule.
+        self.n = [rules.score(r) for r in range(len(rules))]
+        
+        # Time list.
+        self.t = [0] * len(rules)
+        
+        # Position of the last case.
+        self.i = 0
+        
+        # Rule objects for the kernel, made on the first batch.
+        self.views = None
+    
+    def batch(self, cases):
+        """
+        Scores the next block of cases at once with the mask kernel.
+        
+        Returns the same (score, violated, bound) tuple as score() for
+        each case.  Each case's score is added up in rule order, as in
+        score(), so scoring a block gives exactly the same results as
+        scoring its cases one at a time.
+        
+        Key arguments:
+        cases -- the Dataset of the cases.
+        """
+        if self.views == None:
+            self.views = list(self.rules)
+        
+        scores = [0.0] * len(cases)
+        violated = [[] for p in range(len(cases))]
+        bound = 0
+        
+        for r, (mask, _, violations) in enumerate(kernel(cases, self.views)):
+            bound |= mask
+            for p in positions(violations, len(cases)):
+                i = self.i + p + 1
+                violated[p].append(r)
+                scores[p] += (i - self.t[r]) * self.n[r]
+                self.t[r] = i
+        
+        self.i += len(cases)
+        
+        bound = bound.to_bytes(len(cases), 'little')
+        
+        return [(scores[p], violated[p], bound[p] == 1) for p in range(len(cases))]
+    
+    def score(self, case):
+        """
+        Scores the next case.
+        
+        Returns the score, the indices of the rules the case violates
+        and whether any rule binds to it.
+        
+        Key arguments:
+        case -- the case to score.
+        """
+        self.i += 1
+        
+        score = 0.0
+        violated = []
+        
+        rules = self.rules
+        
+        bound = self.index.match(case)
+        for r in bound:
+            value = case[rules.consequents[r]]
+            if value != MISSING and not rules.allows(r, value):
+                violated.append(r)
+                score += (self.i - self.t[r]) * self.n[r]
+                self.t[r] = self.i
+        
+        return score, violated, len(bound) > 0
+    
+    def split(self, case):
+        """
+        Scores the next case against each of the merged models.
+        
+        Returns the score of each model, the indices (within its model) of
+        the rules of each model the case violates, and whether any rule of
+        each model binds to it.  These are the same as scoring the case
+        with a Scorer of each model alone.
+        
+        Key arguments:
+        case -- the case to score.
+        """
+        self.i += 1
+        
+        count = len(self.starts) - 1
+        
+        scores = [0.0] * count
+        violated = [[] for k in range(count)]
+        bound = [False] * count
+        
+        rules = self.rules
+        starts = self.starts
+        
+        # The rules are matched in order, so each model's rules are added
+        #  to its score in the same order as when it is scored alone.
+        k = 0
+        for r in self.index.match(case):
+            while r >= starts[k + 1]:
+                k += 1
+            bound[k] = True
+            value = case[rules.consequents[r]]
+            if value != MISSING and not rules.allows(r, value):
+                violated[k].append(r - starts[k])
+                scores[k] += (self.i - self.t[r]) * self.n[r]
+                self.t[r] = self.i
+        
+        return scores, violated, bound
+
+class Profile(object):
+    """
+    Profile object records the wall time and allocation peak of each phase
+    of a run, and counts operations.
+    
+    A phase ends when the next one starts, and time spent in a phase that
+    is started again (e.g. for each chunk of a file) is added up.  Counts
+    made in worker processes are not collected.
+    """
+    
+    def __init__(self, trace=True):
+        """
+        Profile init
+        
+        Key arguments:
+        trace -- [optional] whether to trace the allocation peaks (which
+                 slows the run down), otherwise the peaks are 0.
+        """
+        # Time, allocation peak and number of starts of each phase.
+        self.phases = {}
+        
+        # Operation counters.
+        self.counters = {}
+        
+        # Current phase and when it started.
+        self.current = None
+        self.started = 0.0
+        
+        self.trace = trace
+        if trace:
+            tracemalloc.start()
+    
+    def count(self, name, n=1):
+        """
+        Adds to a counter.
+        
+        Key arguments:
+        name -- the counter.
+        n    -- [optional] the amount to add.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+    
+    def start(self, name):
+        """
+        Ends the current phase and starts another.
+        
+        Key arguments:
+        name -- the phase.
+        """
+        self.stop()
+        
+        self.current = name
+        if self.trace:
+            tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+    
+    def stop(self):
+        """
+        Ends the current phase.
+        """
+        if self.current == None:
+            return
+        
+        elapsed = time.perf_counter() - self.started
+        peak = 0
+        if self.trace:
+            peak = tracemalloc.get_traced_memory()[1]
+        
+        if not self.current in self.phases:
+            self.phases[self.current] = {'time': 0.0, 'peak': 0, 'starts': 0}
+        phase = self.phases[self.current]
+        phase['time'] += elapsed
+        phase['peak'] = max(phase['peak'], peak)
+        phase['starts'] += 1
+        
+        self.current = None
+    
+    def write(self, path):
+        """
+        Ends the current phase and writes the phases and counters as JSON.
+        
+        Key arguments:
+        path -- the file location.
+        """
+        self.stop()
+        
+        counters = dict(self.counters)
+        if counters.get('scored', 0):
+            counters['fired per record'] = counters.get('fired', 0) / float(counters['scored'])
+        
+        f = open(path, 'w')
+        json.dump({'phases': self.phases, 'counters': counters}, f, indent=1, sort_keys=True)
+        f.write("\n")
+        f.close()
+
+#
+# Methods
+#
+
+def attrs(f):
+    """
+    Parses an attribute file into an attribute dictionary and a values
+    dictionary.
+    
+    Each key in the attribute dictionary (attribute index) contains the
+    attribute name, and each key in the values dictionary contains the
+    list of possible values for that attribute.
+    
+    e.g.:
+    
+        attrs[0] = 'duration'
+        values[0] = ['zero', 'one+', 'ten+', ...]
+        ...
+    
+    Key arguments:
+    f -- the attribute file handle.
+    """
+    ret = {}
+    values = {}
+    
+    i = 0
+    for line in f:
+        # The first item is the attribute name, the rest are possible values.
+        split = line.rstrip("\n").split(" ")
+        ret[i] = split[0]
+        values[i] = split[1:]
+        i += 1
+    
+    return ret, values
+
+def bind(cases, rule):
+    """
+    Binds a rule to a set of cases.
+    
+    The rule's bindings (n) are increased by the number of cases it binds
+    to, and any consequent values it has not seen are added (r).  When the
+    rule's postings are used (see bindings()), the new values are found
+    by grouping the bound cases by their consequent value.
+    
+    Key arguments:
+    cases -- the cases to bind to.
+    rule  -- the rule to update.
+    """
+    # Reference path, case by case.
+    if 'R' in meta['opts']:
+        if profile != None:
+            profile.count('bindings', len(cases))
+        for case in cases:
+            if rule.binds(case):
+                # Increase bindings.
+                rule.bindings += 1
+                # Check if we need to update consequents.
+                value = case[rule.consequent]
+                if value != MISSING and value != unseen(rule.consequent):
+                    rule.allow(value)
+        return
+    
+    attr = rule.consequent
+    
+    found = bindings(cases, rule)
+    if found != None:
+        # Increase bindings.
+        rule.bindings += len(found)
+        
+        # The new consequents are the values of the bound cases.
+        for value in set(map(cases.columns[attr].__getitem__, found)):
+            if value != MISSING and value != unseen(attr):
+                rule.allow(value)
+        return
+    
+    _, count, violations = kernel(cases, [rule])[0]
+    
+    # Increase bindings.
+    rule.bindings += count
+    
+    if not violations:
+        return
+    
+    # Find the new consequents.
+    for value in range(1, len(meta['values'][attr]) + 1):
+        if violations & cases.mask(attr, value):
+            rule.allow(value)
+
+def bindings(cases, rule):
+    """
+    Returns the indices of the cases a rule binds to, in order, when at
+    most one in SPARSE of the cases has the rule's rarest antecedent term.
+    Otherwise returns None, as masks of every case are cheaper.
+    
+    The cases with the rarest term (its postings) are the only ones
+    checked for the rule's other terms, so the work follows the number
+    of cases the rule can bind to rather than the number of cases.
+    
+    Key arguments:
+    cases -- the cases to check.
+    rule  -- the rule.
+    """
+    # Rarest term.
+    first = None
+    for attr, value in rule.antecedent.items():
+        if first == None or cases.count(attr, value) < cases.count(*first):
+            first = (attr, value)
+    
+    if first == None or cases.count(*first) * SPARSE > len(cases):
+        return None
+    
+    found = cases.postings(*first)
+    
+    if profile != None:
+        profile.count('bindings', len(found))
+    
+    # Cases with the rarest term that have the others too.
+    for attr, value in rule.antecedent.items():
+        if (attr, value) != first:
+            found = list(itertools.compress(found, map(value.__eq__, map(cases.columns[attr].__getitem__, found))))
+    
+    return found
+
+def bind_rules(cases, rules):
+    """
+    Binds every rule of a RuleSet to a set of cases (see bind()).
+    
+    Key arguments:
+    cases -- the cases to bind to.
+    rules -- the RuleSet to update.
+    """
+    for r in range(len(rules)):
+        rule = rules.rule(r)
+        bind(cases, rule)
+        rules.update(r, rule)
+
+def cached(path):
+    """
+    Returns the encoded cases of a training/testing file, mapped from its
+    cache file (the file location followed by .cache) when that is valid.
+    Otherwise the file is parsed, and the cache file is written for next
+    time if it can be.
+    
+    A cache file is valid while the training/testing file has the same
+    size, modification time and contents (SHA-256), and the attribute
+    file has the same values.
+    
+    Key arguments:
+    path -- the training/testing file location.
+    """
+    lookup = meta['codes']
+    width = len(lookup)
+    
+    stat = os.stat(path)
+    values = vocabulary()
+    
+    try:
+        f = open(path + ".cache", 'rb')
+        header = f.read(CACHE_HEADER.size)
+    except OSError:
+        pass
+    else:
+        # Check the digest of the contents only once the rest matches.
+        if len(header) == CACHE_HEADER.size:
+            magic, version, attrs, length, size, mtime, digest, found = CACHE_HEADER.unpack(header)
+            if magic == CACHE_MAGIC and version == CACHE_VERSION and attrs == width and size == stat.st_size and mtime == stat.st_mtime_ns and found == values and digest == contents(path):
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                f.close()
+                
+                view = memoryview(buf)
+                position = CACHE_HEADER.size
+                
+                columns = []
+                for attr in range(width):
+                    code = typecode(len(lookup[attr]))
+                    size = struct.calcsize(code) * length
+                    
+                    if sys.byteorder == 'little':
+                        column = view[position:position + size].cast(code)
+                    else:
+                        column = array.array(code)
+                        column.frombytes(view[position:position + size].tobytes())
+                        column.byteswap()
+                    columns.append(column)
+                    
+                    position += size + (-size % 8)
+                
+                return Dataset(columns, length)
+        f.close()
+    
+    digest = contents(path)
+    
+    cases = scan(path)
+    
+    # Write the cache file in full before it replaces an old one, to a
+    #  temporary file of its own as other processes may be writing it too.
+    try:
+        handle, temp = tempfile.mkstemp(".tmp", os.path.basename(path) + ".cache.", os.path.dirname(path) or ".")
+    except OSError:
+        return cases
+    
+    try:
+        f = os.fdopen(handle, 'wb')
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, width, len(cases), stat.st_size, stat.st_mtime_ns, digest, values))
+        for column in cases.columns:
+            column = array.array(column.typecode, column)
+            if sys.byteorder != 'little':
+                column.byteswap()
+            raw = column.tobytes()
+            f.write(raw + b"\x00" * (-len(raw) % 8))
+        f.close()
+        os.replace(temp, path + ".cache")
+    except OSError:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+    
+    return cases
+
+def codes(values):
+    """
+    Builds the value to code lookup for each attribute.
+    
+    Values are coded by their position in the attribute file, starting
+    at 1 so that MISSING (0) never equals a legal value.
+    
+    Key arguments:
+    values -- the values dictionary returned by attrs().
+    """
+    ret = {}
+    
+    for attr, items in values.items():
+        ret[attr] = {}
+        for code, value in enumerate(items):
+            ret[attr][value] = code + 1
+    
+    return ret
+
+def contents(path):
+    """
+    Returns the SHA-256 digest of a file's contents.
+    
+    Key arguments:
+    path -- the file location.
+    """
+    digest = hashlib.sha256()
+    
+    f = open(path, 'rb')
+    while True:
+        block = f.read(1 << 20)
+        if not block:
+            break
+        digest.update(block)
+    f.close()
+    
+    return digest.digest()
+
+def curve(cases, values):
+    """
+    Finds the ROC curve of the scores and the area under it.
+    
+    The cases are sorted by decreasing score.  Lowering the threshold to
+    each distinct score in turn flags the cases with that score, so one
+    pass over the sorted scores gives the detection rate and false alarm
+    rate (as percentages) at every threshold.
+    
+    Returns the (threshold, detection rate, false alarm rate) points, from
+    flagging nothing to flagging every case, and the area.
+    
+    Key arguments:
+    cases  -- the cases to look at.
+    values -- the score of each case.
+    """
+    index, normal = key()
+    
+    # Anomalies are the cases that are not "normal".
+    anomaly = [value != normal for value in cases.columns[index]]
+    positives = anomaly.count(True)
+    negatives = len(anomaly) - positives
+    
+    order = sorted(range(len(values)), key=lambda i: values[i], reverse=True)
+    
+    # True and false positives at each threshold.
+    tp = 0
+    fp = 0
+    counts = [(float('inf'), 0, 0)]
+    
+    j = 0
+    while j < len(order):
+        threshold = values[order[j]]
+        while j < len(order) and values[order[j]] == threshold:
+            if anomaly[order[j]]:
+                tp += 1
+            else:
+                fp += 1
+            j += 1
+        counts.append((threshold, tp, fp))
+    
+    if positives != 0 and negatives != 0:
+        # Trapezoids between neighbouring points.
+        auc = 0.0
+        last = counts[0]
+        for count in counts[1:]:
+            auc += (count[2] - last[2]) * (count[1] + last[1]) / 2.0
+            last = count
+        auc /= float(positives * negatives)
+    else:
+        auc = "NaN"
+    
+    points = []
+    for threshold, tp, fp in counts:
+        # Detection rate.
+        if positives != 0:
+            dr = (tp / float(positives)) * 100
+        else:
+            dr = "NaN"
+        # False positives.
+        if negatives != 0:
+            fa = (fp / float(negatives)) * 100
+        else:
+            fa = "NaN"
+        
+        points.append((threshold, dr, fa))
+    
+    return points, auc
+
+def data(f):
+    """
+    Parses a training/testing file and returns the encoded cases.
+    
+    Every value is replaced by its code from the attribute file, so the
+    cases are stored as one small unsigned column per attribute.
+    
+    e.g.:
+    
+        cases[0] = (1, 1, 2, 2, ...)
+        ...
+    
+    Key arguments:
+    f  -- the file handle.
+    """
+    lookup = meta['codes']
+    width = len(lookup)
+    
+    # One column per attribute in the attribute file.
+    columns = []
+    for attr in range(width):
+        columns.append(array.array(typecode(len(lookup[attr]))))
+    
+    length = 0
+    for line in f:
+        case = parse(line)
+        
+        # Skip blank lines (e.g. at the end of the file).
+        if case == None:
+            continue
+        
+        for i in range(width):
+            columns[i].append(case[i])
+        
+        length += 1
+    
+    # Return the cases.
+    return Dataset(columns, length)
+
+def dataset(cases):
+    """
+    Returns the Dataset of a list of encoded cases (see parse()).
+    
+    Key arguments:
+    cases -- the cases.
+    """
+    lookup = meta['codes']
+    
+    columns = []
+    for attr in range(len(lookup)):
+        columns.append(array.array(typecode(len(lookup[attr])), [case[attr] for case in cases]))
+    
+    return Dataset(columns, len(cases))
+
+def decode(attr, code):
+    """
+    Returns the value of an attribute's code.
+    
+    Key arguments:
+    attr -- the attribute index.
+    code -- the value code.
+    """
+    return meta['values'][attr][code - 1]
+
+def encode(attr, value):
+    """
+    Returns the code of an attribute's value.
+    
+    Key arguments:
+    attr  -- the attribute index.
+    value -- the value.
+    """
+    if not value in meta['codes'][attr]:
+        raise ValueError("Value '" + value + "' is not listed for attribute '" + meta['attrs'][attr] + "'.")
+    
+    return meta['codes'][attr][value]
+
+def encodings():
+    """
+    Returns the bytes to code lookup of each attribute (with None as
+    MISSING) for scan_block(), built from the codes dictionary the first
+    time it is used.
+    """
+    global lookups
+    
+    if lookups == None or lookups[0] is not meta['codes']:
+        encoded = []
+        for attr in range(len(meta['codes'])):
+            values = {None: MISSING}
+            for value, code in meta['codes'][attr].items():
+                values[value.encode()] = code
+            encoded.append(values)
+        lookups = (meta['codes'], encoded)
+    
+    return lookups[1]
+
+def kernel(cases, rules):
+    """
+    Evaluates a block of rules against all the cases at once.
+    
+    Returns a (binding mask, number of bindings, violation mask) tuple
+    for each rule, where the violation mask holds the bound cases whose
+    consequent value is not one of the rule's.  A case that does not
+    have the consequent attribute never violates it.
+    
+    The cases of a rule with a rare antecedent term are found from the
+    term's postings instead (see bindings()), and only those cases are
+    checked for its consequent.
+    
+    Key arguments:
+    cases -- the cases to check.
+    rules -- the rules to check.
+    """
+    if 'R' in meta['opts']:
+        return kernel_reference(cases, rules)
+    
+    ret = []
+    
+    for rule in rules:
+        found = bindings(cases, rule)
+        if found != None:
+            allowed = set(rule.values())
+            allowed.add(MISSING)
+            codes = map(cases.columns[rule.consequent].__getitem__, found)
+            violations = itertools.compress(found, map(operator.not_, map(allowed.__contains__, codes)))
+            
+            ret.append((select(found, len(cases)), len(found), select(violations, len(cases))))
+            continue
+        
+        if profile != None:
+            profile.count('bindings', len(cases))
+        
+        mask = cases.ones()
+        for attr, value in rule.antecedent.items():
+            mask &= cases.mask(attr, value)
+            if not mask:
+                break
+        
+        attr = rule.consequent
+        allowed = cases.mask(attr, MISSING)
+        for value in rule.values():
+            allowed |= cases.mask(attr, value)
+        
+        ret.append((mask, popcount(mask), mask & ~allowed))
+    
+    return ret
+
+def kernel_reference(cases, rules):
+    """
+    Evaluates a block of rules case by case with Rule.binds().
+    
+    This is the reference for kernel(), and returns the same tuples.
+    
+    Key arguments:
+    cases -- the cases to check.
+    rules -- the rules to check.
+    """
+    if profile != None:
+        profile.count('bindings', len(rules) * len(cases))
+    
+    ret = []
+    
+    for rule in rules:
+        binds = bytearray(len(cases))
+        violates = bytearray(len(cases))
+        count = 0
+        
+        i = 0
+        for case in cases:
+            if rule.binds(case):
+                binds[i] = 1
+                count += 1
+                value = case[rule.consequent]
+                if value != MISSING and not rule.allows(value):
+                    violates[i] = 1
+            i += 1
+        
+        ret.append((int.from_bytes(bytes(binds), 'little'), count, int.from_bytes(bytes(violates), 'little')))
+    
+    return ret
+
+def key():
+    """
+    Returns the index of the "normal" attribute (N) and the code of its
+    "normal" value (V).
+    """
+    # Reverse lookup the index for our key attribute.
+    index = None
+    for attr, value in meta['attrs'].items():
+        if value == meta['opts']['N']:
+            index = attr
+    
+    if index == None:
+        raise ValueError("Attribute '" + meta['opts']['N'] + "' is not listed in the attribute file.")
+    
+    return index, encode(index, meta['opts']['V'])
+
+def learn(cases):
+    """
+    Learns rules based on a given set of training cases.
+    
+    Returns the RuleSet of the rules.
+    
+    Key arguments:
+    cases -- the training cases.
+    """
+    if profile != None:
+        profile.start('sample')
+    
+    subset, remaining, validate = partition(cases)
+    
+    rules = learn_sample(subset)
+    
+    if profile != None:
+        profile.start('pass2')
+    
+    # Training pass 2, update the consequents on the remaining
+    #  samples in the training set.
+    bind_rules(remaining, rules)
+    
+    if profile != None:
+        profile.start('validate')
+    
+    # "Validation".
+    validate_rules(validate, rules)
+    
+    return rules
+
+def learn_chunk(cases, rules, tallies, validate):
+    """
+    Runs training pass 2 or validation over one chunk of a training file,
+    and adds the chunk's codes to the tallies.
+    
+    Key arguments:
+    cases    -- the chunk's cases.
+    rules    -- the RuleSet.
+    tallies  -- the tallies of the training cases read so far.
+    validate -- whether the chunk is from the validation set.
+    """
+    if validate:
+        validate_rules(cases, rules)
+    else:
+        bind_rules(cases, rules)
+    
+    for attr, counts in enumerate(tally(cases)):
+        tallies[attr].update(counts)
+
+def learn_sample(subset):
+    """
+    Generates candidate rules from a sample of the training cases and
+    removes the rules covered by others (training pass 1).
+    
+    Returns the RuleSet of the rules.
+    
+    Key arguments:
+    subset -- the sample.
+    """
+    rules = ruleset([])
+    
+    # Linear list of the samples we're going to compare.
+    pairs = sample_pairs(subset, meta['opts']['L'] * 2)
+    
+    workers = meta['opts'].get('W', 1)
+    
+    if profile != None:
+        profile.start('generate')
+    
+    if workers > 1:
+        # Each worker takes a slice of the pairs.  The pairs carry their
+        #  own seeds, so the rules are the same as with one process.
+        size = (len(pairs) + workers - 1) // workers
+        jobs = []
+        for w in range(workers):
+            jobs.append((subset, pairs[w * size:(w + 1) * size]))
+        
+        pool = multiprocessing.Pool(workers, setup, (meta,))
+        try:
+            for candidates in pool.map(generate_candidates, jobs, 1):
+                rules.extend(candidates)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rules = generate_candidates((subset, pairs))
+    
+    if profile != None:
+        profile.count('generated', len(rules))
+        profile.start('coverage')
+        before = len(rules)
+    
+    # "Coverage test".
+    remove_rules(rules)
+    
+    if profile != None:
+        profile.count('covered', before - len(rules))
+    
+    return rules
+
+def learn_stream(path, size):
+    """
+    Learns rules from a training file without holding all of its cases,
+    which are read again for each pass.
+    
+    The validation set, the sample and the pass 2 cases are the same as
+    learn() picks for the whole file, so the rules are too, but only the
+    sample and (size) other cases are held at once.
+    
+    Returns the RuleSet of the rules and the tallies of the training cases.
+    
+    Key arguments:
+    path -- the training file location.
+    size -- the number of cases read at a time.
+    """
+    if size < 1:
+        raise ValueError("Chunk size must be at least one case.")
+    
+    if profile != None:
+        profile.start('count')
+    
+    # Count the cases.
+    f = open(path, 'r')
+    length = 0
+    for line in lines(f):
+        length += 1
+    f.close()
+    
+    if profile != None:
+        profile.start('sample')
+    
+    # Number of validation cases, which come first.
+    num = int(meta['opts']['P'] * length)
+    
+    # Can't have a training set of 0.
+    if num == length:
+        raise ValueError("Training set to small or validation percentage to high.")
+    
+    if meta['opts']['S'] > length - num:
+        raise ValueError("Desired sample size exceeds training cases provided.")
+    
+    # Subset is a random sample of row indices (past the validation set).
+    sampled = sample_subset(range(length - num), meta['opts']['S'])
+    
+    # Position of each sampled row in the subset.
+    chosen = {}
+    for i, row in enumerate(sampled):
+        chosen[num + row] = i
+    
+    # Read the subset.
+    f = open(path, 'r')
+    found = [None] * len(sampled)
+    for row, line in enumerate(lines(f)):
+        if row in chosen:
+            found[chosen[row]] = line
+    f.close()
+    subset = data(found)
+    del found
+    
+    rules = learn_sample(subset)
+    tallies = tally(subset)
+    
+    learn_rest(path, num, chosen, rules, tallies, size)
+    
+    return rules, tallies
+
+def learn_rest(path, num, chosen, rules, tallies, size):
+    """
+    Runs training pass 2 over the cases of a training file past the first
+    (num) and not chosen for the sample, then validation over the first
+    (num), reading (size) cases at a time.
+    
+    Key arguments:
+    path    -- the training file location.
+    num     -- the number of validation cases.
+    chosen  -- the rows of the sampled cases.
+    rules   -- the RuleSet.
+    tallies -- the tallies of the training cases read so far.
+    size    -- the number of cases read at a time.
+    """
+    if profile != None:
+        profile.start('pass2')
+    
+    # Training pass 2, a chunk of the remaining training cases at a time.
+    f = open(path, 'r')
+    chunk = []
+    for row, line in enumerate(lines(f)):
+        if row < num or row in chosen:
+            continue
+        chunk.append(line)
+        if len(chunk) == size:
+            learn_chunk(data(chunk), rules, tallies, False)
+            chunk = []
+    if chunk:
+        learn_chunk(data(chunk), rules, tallies, False)
+    f.close()
+    
+    # "Validation", on the first cases of the file.
+    if profile != None:
+        profile.start('validate')
+    f = open(path, 'r')
+    chunk = []
+    for line in itertools.islice(lines(f), num):
+        chunk.append(line)
+        if len(chunk) == size:
+            learn_chunk(data(chunk), rules, tallies, True)
+            chunk = []
+    if chunk:
+        learn_chunk(data(chunk), rules, tallies, True)
+    f.close()
+
+def learn_sweep(cases, sizes):
+    """
+    Learns the rules of several L and M options from one set of candidates.
+    
+    The candidates are generated once, for the largest L and M.  A chain
+    of generate_rules() holds the rules of every smaller M (its first M),
+    so a smaller M takes the candidates of at most M terms, which are the
+    candidates learn() generates for it.  A smaller L takes the candidates
+    of the first 2L pairs, which are the pairs a separate run draws (see
+    sample_pairs()).  Only the coverage test is run for each size;
+    training pass 2 and validation are run once, on every rule that any
+    size kept.
+    
+    Returns a RuleSet of the rules for each (L, M) size, in order.
+    
+    Key arguments:
+    cases -- the training cases.
+    sizes -- the (L, M) options to learn with.
+    """
+    if profile != None:
+        profile.start('sample')
+    
+    subset, remaining, validate = partition(cases)
+    
+    # Generate with the largest options.
+    meta['opts']['L'] = max([l for l, m in sizes])
+    meta['opts']['M'] = max([m for l, m in sizes])
+    
+    pairs = sample_pairs(subset, meta['opts']['L'] * 2)
+    
+    if profile != None:
+        profile.start('generate')
+    
+    # The pair and antecedent size of each candidate.
+    candidates = ruleset([])
+    found = []
+    for i, (case1, case2, seed) in enumerate(pairs):
+        for rule in generate_rules(case1, case2, seed):
+            bind(subset, rule)
+            candidates.append(rule)
+            found.append((i, len(rule.antecedent)))
+    
+    if profile != None:
+        profile.count('generated', len(candidates))
+        profile.start('coverage')
+    
+    # Rules kept by any size, and the rules each size kept.
+    union = ruleset([])
+    keys = {}
+    kept = []
+    
+    for l, m in sizes:
+        rules = candidates.take([r for r in range(len(candidates)) if found[r][0] < l * 2 and found[r][1] <= m])
+        
+        # "Coverage test".
+        remove_rules(rules)
+        
+        chosen = []
+        for r in range(len(rules)):
+            start = rules.offsets[r]
+            end = rules.offsets[r + 1]
+            
+            # The same rule from another pair is the same after pass 1.
+            k = (rules.consequents[r], tuple(rules.attrs[start:end]), tuple(rules.values[start:end]))
+            if not k in keys:
+                keys[k] = len(union)
+                union.append(rules.rule(r))
+            chosen.append(keys[k])
+        kept.append(chosen)
+    
+    if profile != None:
+        profile.start('pass2')
+    
+    # Training pass 2, update the consequents on the remaining
+    #  samples in the training set.
+    bind_rules(remaining, union)
+    
+    if profile != None:
+        profile.start('validate')
+    
+    # "Validation", a rule is kept if no case violates its consequent.
+    valid = [not violations for _, _, violations in kernel(validate, union)]
+    
+    return [union.take([r for r in indices if valid[r]]) for indices in kept]
+
+def evaluate(cases, values, threshold):
+    """
+    Compares the scores of the cases at a threshold to their class.
+    
+    Cases scoring at or above the threshold are predicted to be anomalies,
+    i.e. not "normal".  Returns the true/false positive/negative counts
+    along with the accuracy (ac), detection rate (dr) and false alarm
+    rate (fa) as percentages.
+    
+    Key arguments:
+    cases     -- the cases to look at.
+    values    -- the score of each case.
+    threshold -- the threshold.
+    """
+    results = {'tp': 0,
+               'tn': 0,
+               'fp': 0,
+               'fn': 0
+               }
+    
+    index, normal = key()
+    
+    i = 0
+    for case in cases:
+        score = values[i]
+        i += 1
+        
+        if score >= threshold:
+            if case[index] != normal:
+                results['tp'] += 1
+            else:
+                results['fp'] += 1
+        else:
+            if case[index] == normal:
+                results['tn'] += 1
+            else:
+                results['fn'] += 1
+    
+    # Accuracy.
+    results['ac'] = ((results['tp'] + results['tn']) / float(results['tp'] + results['tn'] + results['fp'] + results['fn'])) * 100
+    # Detection rate.
+    if results['tp'] != 0 or results['fn'] != 0:
+        results['dr'] = (results['tp'] / float(results['tp'] + results['fn'])) * 100
+    else:
+        results['dr'] = "NaN"
+    # False positives.
+    if results['fp'] != 0 or results['tn'] != 0:
+        results['fa'] = (results['fp'] / float(results['fp'] + results['tn'])) * 100
+    else:
+        results['fa'] = "NaN"
+    
+    return results
+
+def generate_candidates(job):
+    """
+    Generates the candidate rules of a list of pairs.
+    
+    Returns the RuleSet of the rules, counted against the sample.
+    
+    Key arguments:
+    job -- the sample and the pairs (see sample_pairs()).
+    """
+    subset, pairs = job
+    
+    rules = ruleset([])
+    
+    for case1, case2, seed in pairs:
+        for rule in generate_rules(case1, case2, seed):
+            # For each rule, if the rule binds to to a case
+            #  we update the consequents if necessary (r) and the
+            #  the number of bindings (n).
+            bind(subset, rule)
+            rules.append(rule)
+    
+    return rules
+
+def generate_rules(case1, case2, seed):
+    """
+    Generate rules on two cases.
+    
+    Key arguments:
+    case1 -- the first case.
+    case2 -- the second case.
+    seed  -- the random seed of the pair (see sample_pairs()).
+    """
+    attrs = []
+    
+    # Find common attributes (that both cases have, with a listed value).
+    for attr1, value1 in enumerate(case1):
+        if value1 != MISSING and case2[attr1] == value1 and value1 != unseen(attr1):
+            attrs.append(attr1)
+    
+    l = len(attrs)
+    
+    # Return empty set if no matching attributes.
+    if l == 0:
+        return attrs
+    
+    # List of rules.
+    rules = []
+    
+    # Randomly arrange the attributes
+    attrs = random.Random(seed).sample(attrs, l)
+        
+    # Find a random attribute.
+    attr = attrs.pop()
+    l -= 1
+    
+    # Set the base for the following rules.
+    rule = Rule()
+    rule.consequent = attr
+    rule.allow(case1[attr])
+    
+    # Make sure we cap at M rules.  We don't include the first attribute lost.
+    #  that made the consequent because we're not doing wildcards.
+    if l > meta['opts']['M']:
+        l = meta['opts']['M']
+    
+    while l > 0:
+        # Current rule is based on the last one.
+        rule = Rule(rule)
+        
+        attr = attrs.pop()
+        rule.antecedent[attr] = case1[attr]
+        
+        rules.append(rule)
+        
+        l -= 1
+    
+    return rules
+
+def main():
+    """Main execution method."""
+    # Determine command line arguments
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "e:a:t:m:o:L:M:S:P:T:N:V:RK:W:C:I")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    
+    # Process each command line argument.
+    for o, a in opts:
+        meta['opts'][o[1]] = a
+    
+    # The following arguments are required in all cases.
+    for opt in ['e', 'a', 'm', 'o']:
+        if not opt in meta['opts']:
+            usage()
+            sys.exit(2)
+    
+    # Every phase but 'convert' and 'serve' reads cases from a file.
+    if not meta['opts']['e'] in ['convert', 'serve'] and not 't' in meta['opts']:
+        usage()
+        sys.exit(2)
+    
+    # Instrumentation.
+    global profile
+    if 'I' in meta['opts']:
+        profile = Profile()
+        profile.start('parse')
+    
+    # Create attribute set.
+    f = open(meta['opts']['a'], 'r')
+    meta['attrs'], meta['values'] = attrs(f)
+    f.close()
+    meta['codes'] = codes(meta['values'])
+    
+    if meta['opts']['e'] == 'learn':
+        # The following arguments are required in the learning phase.
+        for opt in ['L', 'M', 'S', 'P']:
+            if not opt in meta['opts']:
+                usage()
+                sys.exit(2)
+        
+        # Cast the options to integers.
+        for opt in ['L', 'M', 'S']:
+            meta['opts'][opt] = int(meta['opts'][opt])
+        if 'W' in meta['opts']:
+            meta['opts']['W'] = int(meta['opts']['W'])
+        # Percentage should be a floating point (percentage).
+        meta['opts']['P'] = float(meta['opts']['P'])
+        
+        if 'C' in meta['opts']:
+            # Read the training file C cases at a time.
+            meta['opts']['C'] = int(meta['opts']['C'])
+            rules, tallies = learn_stream(meta['opts']['t'], meta['opts']['C'])
+        else:
+            if profile != None:
+                profile.start('parse')
+            
+            # Create cases set.
+            cases = cached(meta['opts']['t'])
+            
+            # Learn on a sample size of S.
+            rules = learn(cases)
+            tallies = tally(cases)
+        
+        if profile != None:
+            profile.start('write')
+        
+        # Print to files.
+        f1 = open(meta['opts']['m'], 'wb')
+        f2 = open(meta['opts']['o'], 'w')
+        rules.count(tallies)
+        rules.write(f1)
+        for rule in rules:
+            f2.write(str(rule) + "\n")
+        f1.close()
+        f2.close()
+    elif meta['opts']['e'] == 'predict':
+        # The following arguments are required in the learning case.
+        for opt in ['T', 'N', 'V']:
+            if not opt in meta['opts']:
+                usage()
+                sys.exit(2)
+        
+        # Cast to int.
+        meta['opts']['T'] = float(meta['opts']['T'])
+        if 'W' in meta['opts']:
+            meta['opts']['W'] = int(meta['opts']['W'])
+        
+        # Rule matching method.
+        if not meta['opts'].get('K', 'trie') in ['trie', 'index', 'mask']:
+            usage()
+            sys.exit(2)
+        
+        if profile != None:
+            profile.start('load')
+        
+        # Load rules, of each model in a comma separated list.
+        models = [model(path) for path in meta['opts']['m'].split(",")]
+        
+        if profile != None:
+            profile.start('parse')
+        
+        # Create cases set.
+        cases = cached(meta['opts']['t'])
+        
+        predict(cases, models)
+    elif meta['opts']['e'] == 'roc':
+        # The following arguments are required in the roc case.
+        for opt in ['N', 'V']:
+            if not opt in meta['opts']:
+                usage()
+                sys.exit(2)
+        
+        if 'W' in meta['opts']:
+            meta['opts']['W'] = int(meta['opts']['W'])
+        
+        # Rule matching method.
+        if not meta['opts'].get('K', 'trie') in ['trie', 'index', 'mask']:
+            usage()
+            sys.exit(2)
+        
+        if profile != None:
+            profile.start('load')
+        
+        # Load rules.
+        rules = model(meta['opts']['m'])
+        
+        if profile != None:
+            profile.start('parse')
+        
+        # Create cases set.
+        cases = cached(meta['opts']['t'])
+        
+        roc(cases, rules)
+    elif meta['opts']['e'] == 'update':
+        if 'P' in meta['opts']:
+            meta['opts']['P'] = float(meta['opts']['P'])
+        meta['opts']['C'] = int(meta['opts'].get('C', CHUNK))
+        
+        if profile != None:
+            profile.start('load')
+        
+        # Load rules, and copy them out of the file so they can be updated.
+        rules = model(meta['opts']['m'])
+        tallies = rules.tally()
+        rules.keep(range(len(rules)))
+        
+        update(meta['opts']['t'], rules, tallies, meta['opts']['C'])
+        
+        if profile != None:
+            profile.start('write')
+        
+        # Replace the model file only once the new one is complete, from a
+        #  temporary file of its own (with the model file's permissions),
+        #  which is removed if the write fails.
+        path = meta['opts']['m']
+        handle, temp = tempfile.mkstemp(".tmp", os.path.basename(path) + ".", os.path.dirname(path) or ".")
+        try:
+            os.chmod(temp, os.stat(path).st_mode & 0o7777)
+            f1 = os.fdopen(handle, 'wb')
+            rules.count(tallies)
+            rules.write(f1)
+            f1.close()
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        
+        f2 = open(meta['opts']['o'], 'w')
+        for rule in rules:
+            f2.write(str(rule) + "\n")
+        f2.close()
+    elif meta['opts']['e'] == 'convert':
+        if profile != None:
+            profile.start('load')
+        
+        # Load rules.
+        rules = model(meta['opts']['m'])
+        
+        if profile != None:
+            profile.start('write')
+        
+        f = open(meta['opts']['o'], 'wb')
+        rules.write(f)
+        f.close()
+    elif meta['opts']['e'] == 'serve':
+        if profile != None:
+            profile.start('load')
+        
+        # Load rules.
+        rules = model(meta['opts']['m'])
+        
+        serve(meta['opts']['o'], rules)
+    elif meta['opts']['e'] == 'stream':
+        if profile != None:
+            profile.start('load')
+        
+        # Load rules, of each model in a comma separated list.
+        models = [model(path) for path in meta['opts']['m'].split(",")]
+        
+        # A file name of - is standard input/output.
+        if meta['opts']['t'] == '-':
+            f = sys.stdin
+        else:
+            f = open(meta['opts']['t'], 'r')
+        if meta['opts']['o'] == '-':
+            out = sys.stdout
+        else:
+            out = open(meta['opts']['o'], 'w')
+        
+        stream(f, out, models)
+        
+        if f != sys.stdin:
+            f.close()
+        if out != sys.stdout:
+            out.close()
+    else:
+        usage()
+        sys.exit(2)
+    
+    # Write the profile next to the output file (or the model file when
+    #  the output is standard output).
+    if profile != None:
+        if meta['opts']['o'] != '-':
+            profile.write(meta['opts']['o'] + ".profile.json")
+        else:
+            profile.write(meta['opts']['m'] + ".profile.json")
+
+def lines(f):
+    """
+    Yields the lines of a training/testing file that hold a case, skipping
+    blank lines like parse() does.
+    
+    Key arguments:
+    f -- the file handle.
+    """
+    for line in f:
+        if line.rstrip("\n") != "":
+            yield line
+
+def load(buf):
+    """
+    Returns the RuleSet of a binary model file's contents.
+    
+    The sections are used in place (as memoryviews) where the machine
+    is little-endian, so no per-rule objects are made.
+    
+    The codes are only read against the attribute values the model was
+    written with, which version 1 and 2 files do not record.
+    
+    Key arguments:
+    buf -- the file contents (e.g. a mmap).
+    """
+    magic, version, width, count, terms = OLD_HEADER.unpack_from(buf, 0)
+    
+    if magic != MAGIC or not version in [1, 2, VERSION]:
+        raise ValueError("Not a version 1 to " + str(VERSION) + " binary model file.")
+    
+    view = memoryview(buf)
+    position = OLD_HEADER.size
+    
+    if version == VERSION:
+        if HEADER.unpack_from(buf, 0)[5] != vocabulary():
+            raise ValueError("Binary model file was written with other attribute values than the attribute file.")
+        position = HEADER.size
+    
+    lengths = [count + 1, terms, terms, count, count, count * width, terms]
+    
+    # Version 1 files have no counts.
+    if version == 1:
+        lengths.pop()
+    
+    sections = []
+    for typecode, length in zip(SECTIONS, lengths):
+        size = struct.calcsize(typecode) * length
+        
+        if sys.byteorder == 'little':
+            section = view[position:position + size].cast(typecode)
+        else:
+            section = array.array(typecode)
+            section.frombytes(view[position:position + size].tobytes())
+            section.byteswap()
+        sections.append(section)
+        
+        position += size + (-size % 8)
+    
+    if version == 1:
+        sections.append(array.array('Q', [0] * terms))
+    
+    return RuleSet(*(sections + [width]))
+
+def merge(models):
+    """
+    Merges several models into one RuleSet, one after another.
+    
+    Returns the RuleSet and the index of the first rule of each model,
+    followed by the number of rules.
+    
+    Key arguments:
+    models -- the RuleSets of the models.
+    """
+    # A single model is used as it is (e.g. still mapped).
+    if len(models) == 1:
+        return models[0], [0, len(models[0])]
+    
+    rules = ruleset([])
+    starts = [0]
+    
+    for found in models:
+        rules.extend(found)
+        starts.append(len(rules))
+    
+    return rules, starts
+
+def model(path):
+    """
+    Loads a model file into a RuleSet.
+    
+    Binary model files are mapped into memory.  Text model files (one
+    saved rule per line) are parsed and converted.
+    
+    Key arguments:
+    path -- the model file location.
+    """
+    f = open(path, 'rb')
+    
+    if f.read(len(MAGIC)) == MAGIC:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        return load(buf)
+    
+    f.close()
+    
+    rules = []
+    
+    f = open(path, 'r')
+    for line in f:
+        if line.strip():
+            rules.append(Rule(ast.literal_eval(line)))
+    f.close()
+    
+    return ruleset(rules)
+
+def predict(cases, models):
+    """
+    Predicts each of the cases, with each model.
+    
+    The results of each model are written one after another, and a line
+    for each model is printed to the screen.
+    
+    Key arguments:
+    cases  -- the cases to look at.
+    models -- the rules of each model to check against.
+    """
+    # Calculate the score for each case.
+    if len(models) > 1:
+        found = scores_models(cases, models)
+    else:
+        found = [scores(cases, models[0])]
+    
+    output = ""
+    
+    for k, (values, flagged, unclassified) in enumerate(found):
+        results = evaluate(cases, values, meta['opts']['T'])
+        
+        if len(models) > 1:
+            if k > 0:
+                output += "\n"
+            output += "Model:\t\t\t\t" + str(k + 1) + "\n\n"
+        
+        output += predict_results(cases, flagged, unclassified, results)
+        
+        # Print detection rate and false alarm rate to screen for easy parsing later.
+        print(str(results['ac']) + " \t" + str(results['dr']) + "\t" + str(results['fa']))
+    
+    f = open(meta['opts']['o'], 'w')
+    f.write(output)
+    f.close()
+
+def predict_results(cases, flagged, unclassified, results):
+    """
+    Returns the human readable results of a model.
+    
+    Key arguments:
+    cases        -- the cases.
+    flagged      -- the number of flagged cases.
+    unclassified -- the number of unclassified cases.
+    results      -- the results of evaluate().
+    """
+    output = ""
+    output += "Flagged:\t\t\t" + str(flagged) + "\n"
+    output += "Unclassified:\t\t\t" + str(unclassified) + "\n\n"
+    output += "True Positives:\t\t\t" + str(results['tp']) + "\n"
+    output += "True Negatives:\t\t\t" + str(results['tn']) + "\n"
+    output += "False Positives:\t\t" + str(results['fp']) + "\n"
+    output += "False Negatives:\t\t" + str(results['fn']) + "\n"
+    output += "Total:\t\t\t\t" + str(len(cases)) + "\n\n"
+    output += "Accuracy:\t\t\t" + str(results['ac']) + "%\n"
+    output += "Detection Rate:\t\t\t" + str(results['dr']) + "%\n"
+    output += "False Alarm Rate:\t\t" + str(results['fa']) + "%\n"
+    
+    return output
+
+def parse(line):
+    """
+    Parses one line of a training/testing file into an encoded case.
+    
+    A value that is not listed for its attribute gets the attribute's
+    unseen() code.
+    
+    Returns None for a blank line.
+    
+    Key arguments:
+    line -- the line.
+    """
+    lookup = meta['codes']
+    width = len(lookup)
+    
+    split = line.rstrip("\r\n").split(" ")
+    
+    if split == [""]:
+        return None
+    
+    if len(split) > width:
+        raise ValueError("Case '" + line.rstrip("\r\n") + "' has more values than there are attributes.")
+    
+    case = []
+    
+    i = 0
+    for value in split:
+        # Set the attribute and the value (values that are not listed get
+        #  the unseen code).
+        case.append(lookup[i].get(value, len(lookup[i]) + 1))
+        
+        i += 1
+    
+    # Attributes the case does not have.
+    while i < width:
+        case.append(MISSING)
+        i += 1
+    
+    return tuple(case)
+
+def partition(cases):
+    """
+    Splits the training cases for learning.
+    
+    The first P of the cases are the validation set, and a random sample
+    of S of the rest is the sample the candidate rules are generated from.
+    The rest of the training set is kept for training pass 2 (by row, so
+    a case repeated outside the sample is still counted).
+    
+    Returns the sample, the rest of the training set and the validation
+    set.
+    
+    Key arguments:
+    cases -- the training cases.
+    """
+    # Number of validation cases.
+    num = int(meta['opts']['P'] * len(cases))
+    
+    # Can't have a training set of 0.
+    if num == len(cases):
+        raise ValueError("Training set to small or validation percentage to high.")
+    
+    # Make training and validation set.
+    train = cases[num:]
+    validate = cases[:num]
+    
+    if meta['opts']['S'] > len(train):
+        raise ValueError("Desired sample size exceeds training cases provided.")
+    
+    # Subset is a random sample of row indices.
+    sampled = sample_subset(range(len(train)), meta['opts']['S'])
+    subset = train.take(sampled)
+    
+    chosen = bytearray(len(train))
+    for i in sampled:
+        chosen[i] = 1
+    remaining = train.take([i for i in range(len(train)) if not chosen[i]])
+    
+    return subset, remaining, validate
+
+def popcount(mask):
+    """
+    Returns the number of cases in a mask (or of bits in a value set).
+    
+    Key arguments:
+    mask -- the mask.
+    """
+    return mask.bit_count()
+
+def positions(mask, length):
+    """
+    Returns the indices of the cases in a mask, in order.
+    
+    Key arguments:
+    mask   -- the mask.
+    length -- the number of cases the mask covers.
+    """
+    ret = []
+    
+    raw = mask.to_bytes(length, 'little')
+    i = raw.find(1)
+    while i != -1:
+        ret.append(i)
+        i = raw.find(1, i + 1)
+    
+    return ret
+
+def remove_rules(rules):
+    """
+    Removes redundant rules (coverage test).
+    
+    In decreasing n/r, a rule is kept unless the antecedent of a rule
+    already kept is part of its own.  The kept antecedents are hashed as
+    sorted term tuples, so a rule looks up each part of its antecedent
+    (of a size some kept antecedent has) instead of comparing itself to
+    every kept rule.  It only compares itself to every kept rule when
+    that is fewer checks.
+    
+    Key arguments:
+    rules -- the RuleSet to reduce.
+    """
+    # Reference path, all pairs.
+    if 'R' in meta['opts']:
+        remove_rules_reference(rules)
+        return
+    
+    # Sort in decreasing n/r.
+    scores = rules.scores()
+    order = sorted(range(len(rules)), key=scores.__getitem__, reverse=True)
+    
+    # Antecedents of the kept rules (and their indices).
+    kept = []
+    chosen = []
+    
+    # Antecedents of the kept rules, and their sizes.
+    antecedents = set()
+    sizes = set()
+    
+    for r in order:
+        start = rules.offsets[r]
+        end = rules.offsets[r + 1]
+        terms = tuple(sorted(zip(rules.attrs[start:end], rules.values[start:end])))
+        
+        checks = 0
+        for size in sizes:
+            if size <= len(terms):
+                checks += math.comb(len(terms), size)
+        
+        covered = False
+        if checks <= len(kept):
+            for size in sizes:
+                if size > len(terms):
+                    continue
+                for part in itertools.combinations(terms, size):
+                    if part in antecedents:
+                        covered = True
+                        break
+                if covered:
+                    break
+        else:
+            found = dict(terms)
+            for other in kept:
+                if all(found.get(attr) == value for attr, value in other):
+                    covered = True
+                    break
+        
+        if not covered:
+            kept.append(terms)
+            chosen.append(r)
+            antecedents.add(terms)
+            sizes.add(len(terms))
+    
+    rules.keep(chosen)
+
+def remove_rules_reference(rules):
+    """
+    Removes redundant rules by comparing every pair (coverage test).
+    
+    This is the reference for remove_rules(), and keeps the same rules.
+    
+    Key arguments:
+    rules -- the RuleSet to reduce.
+    """
+    # Sort in decreasing n/r.
+    scores = rules.scores()
+    order = sorted(range(len(rules)), key=scores.__getitem__, reverse=True)
+    found = [rules.rule(r) for r in order]
+    
+    # Remove redundant rules.
+    l = len(found)
+    i = 1
+    while i < l:
+        j = 0
+        while j < i:
+            if found[j].covers(found[i]):
+                found.pop(i)
+                order.pop(i)
+                l = len(found)
+                j = 0
+                if i >= l:
+                    break
+            else:
+                j += 1
+        i += 1
+    
+    rules.keep(order)
+
+def roc(cases, rules):
+    """
+    Finds the ROC curve and the area under it.
+    
+    Key arguments:
+    cases -- the cases to look at.
+    rules -- the rules to check against.
+    """
+    values, _, _ = scores(cases, rules)
+    
+    points, auc = curve(cases, values)
+    
+    output = ""
+    for threshold, dr, fa in points:
+        output += str(threshold) + "\t" + str(dr) + "\t" + str(fa) + "\n"
+    
+    f = open(meta['opts']['o'], 'w')
+    f.write(output)
+    f.close()
+    
+    # Print the area to screen for easy parsing later.
+    print(str(auc))
+
+def ruleset(rules, tallies=None):
+    """
+    Packs rules into a RuleSet.
+    
+    Key arguments:
+    rules   -- the rules.
+    tallies -- [optional] the count of every code of each attribute in the
+               training cases (see tally()), for the antecedent terms.
+    """
+    # Words needed for the largest attribute's codes, up to its unseen()
+    #  code.
+    width = 1
+    for values in meta['values'].values():
+        width = max(width, (len(values) + 65) // 64)
+    
+    ret = RuleSet(array.array('I', [0]), array.array('H'), array.array('I'), array.array('H'), array.array('Q'), array.array('Q'), array.array('Q'), width)
+    
+    for rule in rules:
+        ret.append(rule)
+    
+    # Training cases with each term.
+    if tallies != None:
+        ret.count(tallies)
+    
+    return ret
+
+def sample_subset(cases, size):
+    """
+    Returns a random unique subset of (size) samples.
+    
+    The indices are drawn without replacement by random.sample(), so
+    each draw is unique without searching the ones before it.
+    
+    Key arguments:
+    cases -- the set of cases.
+    size  -- the number of samples to return.
+    """
+    if size > len(cases):
+        raise ValueError("Sample size exceeds the number of cases.")
+    
+    return [cases[index] for index in random.sample(range(len(cases)), size)]
+
+def sample_pairs(cases, size):
+    """
+    Returns (size) random pairs, each with the seed its rules are drawn
+    with (see generate_rules()).
+    
+    The first index of each pair is drawn from every case and the second
+    from every other case (by a non-zero offset from the first), so no
+    draws are rejected.  Each pair is drawn by a generator of its own,
+    seeded from a single draw of the master seed and its position, so the
+    first pairs (and their rules) are the same whatever the size.
+    
+    Key arguments:
+    cases -- the set of cases.
+    size  -- the number of samples to return.
+    """
+    l = len(cases)
+    
+    # We don't want an instance to compare to itself.
+    if l < 2:
+        raise ValueError("Pairs need at least two cases.")
+    
+    base = str(random.getrandbits(32)) + ":"
+    
+    pairs = []
+    for i in range(size):
+        rnd = random.Random(base + str(i))
+        index = rnd.randrange(l)
+        offset = rnd.randrange(1, l)
+        pairs.append((cases[index], cases[(index + offset) % l], rnd.getrandbits(32)))
+    
+    return pairs
+
+def scan(path):
+    """
+    Parses a training/testing file and returns the encoded cases, as
+    data() does, from the mapped file.
+    
+    The file is split into blocks of about BLOCK bytes that end at a line
+    break, and each block is encoded by scan_block(), in a pool of worker
+    processes when W is more than 1.  The blocks come back as the raw
+    codes of each column, which are joined in file order.
+    
+    Key arguments:
+    path -- the training/testing file location.
+    """
+    lookup = meta['codes']
+    width = len(lookup)
+    
+    # One column per attribute in the attribute file.
+    columns = []
+    for attr in range(width):
+        columns.append(array.array(typecode(len(lookup[attr]))))
+    
+    # Find the blocks.
+    jobs = []
+    f = open(path, 'rb')
+    size = os.fstat(f.fileno()).st_size
+    if size > 0:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = 0
+        while start < size:
+            end = buf.find(b"\n", min(start + BLOCK, size) - 1)
+            if end == -1:
+                end = size
+            else:
+                end += 1
+            jobs.append((path, start, end))
+            start = end
+        buf.close()
+    f.close()
+    
+    workers = meta['opts'].get('W', 1)
+    
+    pool = None
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(jobs)), setup, (meta,))
+        blocks = pool.imap(scan_block, jobs)
+    else:
+        blocks = map(scan_block, jobs)
+    
+    length = 0
+    try:
+        for count, raws in blocks:
+            for column, raw in zip(columns, raws):
+                column.frombytes(raw)
+            length += count
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+    
+    return Dataset(columns, length)
+
+def scan_block(job):
+    """
+    Encodes the cases of a block of a training/testing file (see scan()).
+    
+    The lines are split into byte tokens, which are looked up a column at
+    a time in the attribute's values (as bytes, see encodings()), so no
+    strings are made.
+    When every line has the same number of values, the whole block is
+    split at once and each column is a slice of the tokens.
+    As in parse(), values that are not listed get the attribute's unseen()
+    code, and attributes a case does not have are MISSING.
+    
+    Returns the number of cases and the raw codes of each column.
+    
+    Key arguments:
+    job -- the file location, and the start and end of the block.
+    """
+    path, start, end = job
+    
+    lookup = meta['codes']
+    width = len(lookup)
+    
+    f = open(path, 'rb')
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    block = buf[start:end]
+    buf.close()
+    f.close()
+    
+    lines = block.split(b"\n")
+    if b"\r" in block:
+        lines = [line.rstrip(b"\r") for line in lines]
+    
+    # Skip blank lines (e.g. at the end of the file).
+    lines = list(filter(None, lines))
+    
+    # Spaces on each line.
+    sizes = set(map(bytes.count, lines, itertools.repeat(b" ", len(lines))))
+    
+    if sizes and max(sizes) >= width:
+        for line in lines:
+            if line.count(b" ") >= width:
+                raise ValueError("Case '" + line.decode(errors='replace') + "' has more values than there are attributes.")
+    
+    if len(sizes) == 1:
+        # Every case has the same attributes, so each attribute's tokens
+        #  are every k-th token of the block.
+        k = sizes.pop() + 1
+        tokens = b" ".join(lines).split(b" ")
+        columns = [tokens[attr::k] for attr in range(k)]
+    else:
+        # Tokens of each attribute, None where a case does not have it.
+        columns = list(itertools.zip_longest(*[line.split(b" ") for line in lines]))
+    
+    raws = []
+    
+    encoded = encodings()
+    
+    for attr, tokens in enumerate(columns):
+        values = encoded[attr]
+        
+        column = array.array(typecode(len(lookup[attr])), list(map(values.get, tokens, itertools.repeat(unseen(attr), len(tokens)))))
+        raws.append(column.tobytes())
+    
+    # Attributes no case has.
+    for attr in range(len(raws), width):
+        raws.append(array.array(typecode(len(lookup[attr])), [MISSING]).tobytes() * len(lines))
+    
+    return len(lines), raws
+
+def scores(cases, rules):
+    """
+    Calculates the anomaly score of each case.
+    
+    Each rule a case violates adds (i - t) * n/r to its score, where i is
+    the case's position and t is the position of the last case that
+    violated the rule (0 if none).
+    
+    Returns the scores, the number of flagged cases (that violate a rule)
+    and the number of unclassified cases (that no rule binds to).
+    
+    With more than one worker (W), each worker process evaluates a shard
+    of the rules against all the cases at once (see scores_shard()).
+    The shards' contributions are added in rule order, which is the order
+    every path adds them to a case's score, so the scores are exactly the
+    same as with one process.
+    
+    Key arguments:
+    cases -- the cases to score.
+    rules -- the rules (or RuleSet) to check against.
+    """
+    workers = meta['opts'].get('W', 1)
+    
+    if profile != None:
+        profile.start('score')
+        profile.count('scored', len(cases))
+    
+    # Reference path, case by case.
+    if 'R' in meta['opts']:
+        if isinstance(rules, RuleSet):
+            rules = list(rules)
+        return scores_reference(cases, rules)
+    
+    # Rule index or trie path, case by case.
+    if meta['opts'].get('K', 'trie') != 'mask' and workers <= 1:
+        return scores_index(cases, Scorer(rules))
+    
+    if not isinstance(rules, RuleSet):
+        rules = ruleset(rules)
+    
+    if workers > 1:
+        # Each worker takes a contiguous shard of the rules.
+        size = (len(rules) + workers - 1) // workers
+        jobs = []
+        for w in range(workers):
+            jobs.append((cases, rules.take(range(w * size, min((w + 1) * size, len(rules))))))
+        
+        pool = multiprocessing.Pool(workers, setup, (meta,))
+        try:
+            shards = pool.map(scores_shard, jobs, 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        shards = [scores_shard((cases, rules))]
+    
+    ret = [0.0] * len(cases)
     
-    for rule in rules:
-        for case in remaining:
-            if rule.binds(case):
-                # Increase bindings.
-                rule.bindings += 1
-                # Check if we need to update consequents.
-                if not case[rule.consequent[0]] in rule.consequent[1]:
-                    rule.consequent[1].append(case[rule.consequent[0]])
+    flagged = 0
+    classified = 0
     
-    # "Validation".
-    validate_rules(validate, rules)
+    for found, values, mask, violations in shards:
+        classified |= mask
+        flagged |= violations
+        
+        for i, value in zip(found, values):
+            ret[i] += value
+        
+        if profile != None:
+            profile.count('fired', len(found))
     
-    # Print to files.
-    f1 = open(meta['opts']['m'], 'w')
-    f2 = open(meta['opts']['o'], 'w')
-    for rule in rules:
-        f1.write(rule.save() + "\n")
-        f2.write(str(rule) + "\n")
-    f1.close()
-    f2.close()
+    return ret, popcount(flagged), len(cases) - popcount(classified)
 
-def generate_rules(case1, case2):
+def scores_index(cases, scorer):
     """
-    Generate rules on two cases.
+    Calculates the anomaly score of each case with a rule index.
+    
+    Only the rules the index matches to a case are checked, and this
+    returns the same tuple as scores().
     
     Key arguments:
-    case1 -- the first case.
-    case2 -- the second case.
+    cases  -- the cases to score.
+    scorer -- the Scorer of the rules to check against.
     """
-    attrs = []
+    ret = []
     
-    # Find common attributes.
-    for attr1, value1 in case1.items():
-        if attr1 in case2 and case2[attr1] == value1: 
-            attrs.append(attr1)
+    flagged = 0
+    unclassified = 0
     
-    l = len(attrs)
+    # Rules fired (violated) in all.
+    fired = 0
     
-    # Return empty set if no matching attributes.
-    if l == 0:
-        return attrs
+    for case in cases:
+        score, violated, bound = scorer.score(case)
+        if violated:
+            flagged += 1
+            fired += len(violated)
+        if not bound:
+            unclassified += 1
+        
+        ret.append(score)
     
-    # List of rules.
-    rules = []
+    if profile != None:
+        profile.count('fired', fired)
     
-    # Randomly arrange the attributes
-    attrs = sample_subset(attrs, l)
-        
-    # Find a random attribute.
-    attr = attrs.pop()
-    l -= 1
+    return ret, flagged, unclassified
+
+def scores_models(cases, models):
+    """
+    Calculates the anomaly score of each case against several models.
     
-    # Set the base for the following rules.
-    rule = Rule()
-    rule.consequent = (attr, [case1[attr]])
+    The models are merged, so each case is matched against all of their
+    rules at once (see Scorer.split()).  Other paths than the rule index
+    or trie score the (already encoded) cases against each model in turn.
     
-    # Make sure we cap at M rules.  We don't include the first attribute lost.
-    #  that made the consequent because we're not doing wildcards.
-    if l > meta['opts']['M']:
-        l = meta['opts']['M']
+    Returns the same tuple as scores() for each model.
     
-    while l > 0:
-        # Current rule is based on the last one.
-        rule = Rule(rule)
-        
-        attr = attrs.pop()
-        rule.antecedent[attr] = case1[attr]
-        
-        rules.append(rule)
-        
-        l -= 1
+    Key arguments:
+    cases  -- the cases to score.
+    models -- the RuleSets of the models.
+    """
+    if meta['opts'].get('K', 'trie') == 'mask' or 'R' in meta['opts'] or meta['opts'].get('W', 1) > 1:
+        return [scores(cases, rules) for rules in models]
     
-    return rules
+    if profile != None:
+        profile.start('score')
+        profile.count('scored', len(cases))
+    
+    rules, starts = merge(models)
+    scorer = Scorer(rules, starts)
+    
+    ret = []
+    flagged = []
+    unclassified = []
+    for k in range(len(models)):
+        ret.append([])
+        flagged.append(0)
+        unclassified.append(0)
+    
+    # Rules fired (violated) in all.
+    fired = 0
+    
+    for case in cases:
+        values, violated, bound = scorer.split(case)
+        for k in range(len(models)):
+            if violated[k]:
+                flagged[k] += 1
+                fired += len(violated[k])
+            if not bound[k]:
+                unclassified[k] += 1
+            
+            ret[k].append(values[k])
+    
+    if profile != None:
+        profile.count('fired', fired)
+    
+    return list(zip(ret, flagged, unclassified))
 
-def main():
-    """Main execution method."""
-    # Determine command line arguments
-    try:
-        opts, _ = getopt.getopt(sys.argv[1:], "e:a:t:m:o:L:M:S:P:T:N:V:")
-    except getopt.GetoptError:
-        usage()
-        sys.exit(2)
+def scores_shard(job):
+    """
+    Evaluates a shard of the rules against all the cases at once.
     
-    # Process each command line argument.
-    for o, a in opts:
-        meta['opts'][o[1]] = a
+    Returns the positions of the cases that violate each rule and what
+    the rule adds to their scores, rule after rule, followed by the
+    classified (bound) and flagged (violating) case masks.
     
-    # The following arguments are required in all cases.
-    for opt in ['e', 'a', 't', 'm', 'o']:
-        if not opt in meta['opts']:
-            usage()
-            sys.exit(2)
+    Key arguments:
+    job -- the cases and the RuleSet of the shard.
+    """
+    cases, rules = job
     
-    # Create attribute set.
-    f = open(meta['opts']['a'], 'r')
-    meta['attrs'] = attrs(f)
-    f.close()
+    found = array.array('I')
+    values = array.array('d')
     
-    # Create cases set.
-    f = open(meta['opts']['t'], 'r')
-    cases = data(f)
-    f.close()
+    flagged = 0
+    classified = 0
     
-    if meta['opts']['e'] == 'learn':
-        # The following arguments are required in the learning phase.
-        for opt in ['L', 'M', 'S', 'P']:
-            if not opt in meta['opts']:
-                usage()
-                sys.exit(2)
-        
-        # Cast the options to integers.
-        for opt in ['L', 'M', 'S']:
-            meta['opts'][opt] = int(meta['opts'][opt])
-        # Percentage should be a floating point (percentage).
-        meta['opts']['P'] = float(meta['opts']['P'])
-        
-        # Learn on a sample size of S.
-        learn(cases)
-    elif meta['opts']['e'] == 'predict':
-        # The following arguments are required in the learning case.
-        for opt in ['T', 'N', 'V']:
-            if not opt in meta['opts']:
-                usage()
-                sys.exit(2)
-        
-        # Cast to int.
-        meta['opts']['T'] = float(meta['opts']['T'])
-        
-        # Load rules.
-        rules = []
-        f = open(meta['opts']['m'], 'r')
-        for line in f:
-            rules.append(Rule(eval(line)))
-        f.close()
+    # Each rule adds to the scores of the cases that violate it, in order.
+    for r, (mask, _, violations) in enumerate(kernel(cases, rules)):
+        classified |= mask
+        flagged |= violations
         
-        predict(cases, rules)
-    else:
-        usage()
-        sys.exit(2)
+        t = 0
+        score = rules.score(r)
+        for i in positions(violations, len(cases)):
+            found.append(i)
+            values.append((i + 1 - t) * score)
+            t = i + 1
+    
+    return found, values, classified, flagged
 
-def predict(cases, rules):
+def scores_reference(cases, rules):
     """
-    Predicts each of the cases.
+    Calculates the anomaly score of each case with Rule.binds().
+    
+    This is the reference for scores(), and returns the same tuple.
     
     Key arguments:
-    cases -- the cases to look at.
+    cases -- the cases to score.
     rules -- the rules to check against.
     """
-    results = {'tp': 0,
-               'tn': 0,
-               'fp': 0,
-               'fn': 0
-               }
-    
-    # Reverse lookup the index for our key attribute.
-    index = None
-    for attr, value in meta['attrs'].items():
-        if value == meta['opts']['N']:
-            index = attr
+    ret = []
     
     # Time dictionary.
     t = {}
     for rule in rules:
         t[rule] = 0
     
-    # Calculate the score for each case.
     flagged = 0
     unclassified = 0
+    fired = 0
     
     i = 0
     for case in cases:
@@ -419,8 +3115,10 @@ def predict(cases, rules):
         for rule in rules:
             if rule.binds(case):
                 classified = True
-                if not case[rule.consequent[0]] in rule.consequent[1]:
+                value = case[rule.consequent]
+                if value != MISSING and not rule.allows(value):
                     flag = True
+                    fired += 1
                     score += (i - t[rule]) * rule.score()
                     t[rule] = i
         if flag:
@@ -428,134 +3126,340 @@ def predict(cases, rules):
         if not classified:
             unclassified += 1
         
-        if score >= meta['opts']['T']:
-            if case[index] != meta['opts']['V']:
-                results['tp'] += 1
-            else:
-                results['fp'] += 1
-        else:
-            if case[index] == meta['opts']['V']:
-                results['tn'] += 1
-            else:
-                results['fn'] += 1
-    
-    # Accuracy.
-    ac = ((results['tp'] + results['tn']) / float(results['tp'] + results['tn'] + results['fp'] + results['fn'])) * 100
-    # Detection rate.
-    if results['tp'] != 0 or results['fn'] != 0:
-        dr = (results['tp'] / float(results['tp'] + results['fn'])) * 100
-    else:
-        dr = "NaN"
-    # False positives.
-    if results['fp'] != 0 or results['tn'] != 0:
-        fa = (results['fp'] / float(results['fp'] + results['tn'])) * 100
-    else:
-        fa = "NaN"
-    
-    output = ""
-    output += "Flagged:\t\t\t" + str(flagged) + "\n"
-    output += "Unclassified:\t\t\t" + str(unclassified) + "\n\n"
-    output += "True Positives:\t\t\t" + str(results['tp']) + "\n"
-    output += "True Negatives:\t\t\t" + str(results['tn']) + "\n"
-    output += "False Positives:\t\t" + str(results['fp']) + "\n"
-    output += "False Negatives:\t\t" + str(results['fn']) + "\n"
-    output += "Total:\t\t\t\t" + str(len(cases)) + "\n\n"
-    output += "Accuracy:\t\t\t" + str(ac) + "%\n"
-    output += "Detection Rate:\t\t\t" + str(dr) + "%\n"
-    output += "False Alarm Rate:\t\t" + str(fa) + "%\n"
+        ret.append(score)
     
-    f = open(meta['opts']['o'], 'w')
-    f.write(output)
-    f.close()
+    if profile != None:
+        profile.count('bindings', len(rules) * len(cases))
+        profile.count('fired', fired)
     
-    # Print detection rate and false alarm rate to screen for easy parsing later.
-    print(str(ac) + " \t" + str(dr) + "\t" + str(fa))
+    return ret, flagged, unclassified
 
-def remove_rules(rules):
+def select(indices, length):
     """
-    Removes redundant rules (coverage test).
+    Returns the mask of the cases at the given indices.
     
     Key arguments:
-    rules -- the rules to reduce.
+    indices -- the case indices.
+    length  -- the number of cases the mask covers.
     """
-    # Sort in decreasing n/r.
-    rules.sort(key=lambda x: x.score(), reverse=True)
+    raw = bytearray(length)
+    for i in indices:
+        raw[i] = 1
     
-    # Remove redundant rules.
-    l = len(rules)
-    i = 1
-    while i < l:
-        j = 0
-        while j < i:
-            if rules[j].binds(rules[i].antecedent):
-                rules.pop(i)
-                l = len(rules)
-                j = 0
-                if i >= l:
-                    break
-            else:
-                j += 1
-        i += 1
+    return int.from_bytes(raw, 'little')
 
-def sample_subset(cases, size):
+def serve(path, rules):
     """
-    Returns a random unique subset of (size) samples.
+    Scores cases sent over a Unix socket, keeping the rules and the time
+    each rule was last violated warm between requests.
+    
+    Clients send cases one per line, and get back a line for each case in
+    the same form as stream() writes.  The lines that arrive together,
+    from any of the clients, are scored as one block (see Scorer.batch()),
+    in the order they arrived.  A line of #stats is answered with the
+    number of cases and blocks scored and the latency percentiles (in
+    milliseconds) as JSON, counting the cases of its own block, and a
+    line of #quit stops the server.  Lines that can not be decoded or
+    parsed are answered with the error, and a client that sends a line
+    longer than PENDING bytes is disconnected.  Replies to clients that
+    have gone are dropped.
     
     Key arguments:
-    cases -- the set of cases.
-    size  -- the number of samples to return.
+    path  -- the socket file location.
+    rules -- the rules to check against.
     """
-    ret = []
-    l = len(cases) - 1
+    scorer = Scorer(rules)
     
-    indices = []
+    if os.path.exists(path):
+        os.remove(path)
     
-    i = 0
-    while i < size:
-        index = random.randint(0, l)
-        if not index in indices:
-            indices.append(index)
-            i += 1
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    
+    # Partial line of each client.
+    pending = {}
+    
+    # Latency of each case (the time from its block arriving to being
+    #  scored), and the number of blocks.
+    latencies = collections.deque(maxlen=LATENCIES)
+    batches = 0
+    
+    running = True
+    try:
+        while running:
+            # Lines that arrived together, in order.
+            found = []
+            for key, _ in selector.select():
+                if key.fileobj == server:
+                    client, _ = server.accept()
+                    selector.register(client, selectors.EVENT_READ)
+                    pending[client] = b""
+                    continue
+                
+                client = key.fileobj
+                try:
+                    chunk = client.recv(65536)
+                except OSError:
+                    # Treated as the client closing (e.g. reset by peer).
+                    chunk = b""
+                
+                buf = pending.get(client, b"") + chunk
+                end = buf.rfind(b"\n") + 1
+                for line in buf[:end].split(b"\n")[:-1]:
+                    found.append((client, line))
+                
+                if chunk and len(buf) - end > PENDING:
+                    try:
+                        client.sendall(("error\tLine is longer than " + str(PENDING) + " bytes.\n").encode())
+                    except OSError:
+                        pass
+                    chunk = b""
+                
+                if not chunk:
+                    selector.unregister(client)
+                    client.close()
+                    del pending[client]
+                    continue
+                
+                pending[client] = buf[end:]
+            
+            if not found:
+                continue
+            
+            start = time.perf_counter()
+            
+            # The answer to each line, None for the cases to score and
+            #  False for the stats (given once the block is scored).
+            answers = []
+            cases = []
+            for client, line in found:
+                try:
+                    line = line.decode()
+                except UnicodeDecodeError as e:
+                    answers.append("error\t" + str(e))
+                    continue
+                
+                if line.rstrip() == "#stats":
+                    answers.append(False)
+                elif line.rstrip() == "#quit":
+                    answers.append("bye")
+                    running = False
+                else:
+                    try:
+                        case = parse(line)
+                    except ValueError as e:
+                        answers.append("error\t" + str(e))
+                        continue
+                    if case == None:
+                        answers.append("")
+                        continue
+                    answers.append(None)
+                    cases.append(case)
+            
+            results = []
+            if cases:
+                results = scorer.batch(dataset(cases))
+                batches += 1
+            
+            elapsed = time.perf_counter() - start
+            latencies.extend([elapsed] * len(cases))
+            
+            # Answer each client in the order its lines arrived.
+            replies = {}
+            position = scorer.i - len(cases)
+            j = 0
+            for (client, _), answer in zip(found, answers):
+                if answer == False:
+                    answer = json.dumps(serve_stats(latencies, scorer.i, batches))
+                elif answer == None:
+                    score, violated, _ = results[j]
+                    j += 1
+                    position += 1
+                    answer = str(position) + "\t" + str(score) + "\t" + ",".join([str(r + 1) for r in violated])
+                replies[client] = replies.get(client, "") + answer + "\n"
+            
+            for client, reply in replies.items():
+                # Drop the replies of clients that have gone.
+                if not client in pending:
+                    continue
+                
+                try:
+                    client.sendall(reply.encode())
+                except OSError:
+                    selector.unregister(client)
+                    client.close()
+                    del pending[client]
+    finally:
+        for client in pending:
+            client.close()
+        selector.close()
+        server.close()
+        os.remove(path)
+    
+    # Print the latencies to screen for easy parsing later.
+    print(json.dumps(serve_stats(latencies, scorer.i, batches)))
+
+def serve_stats(latencies, cases, batches):
+    """
+    Returns the number of cases and blocks scored by serve() and the
+    latency percentiles, in milliseconds.
+    
+    Key arguments:
+    latencies -- the latency of each (recent) case, in seconds.
+    cases     -- the number of cases.
+    batches   -- the number of blocks.
+    """
+    ret = {'cases': cases, 'batches': batches}
     
-    for index in indices:
-        ret.append(cases[index])
+    found = sorted(latencies)
+    for percentile in [50, 90, 99, 100]:
+        if found:
+            ret['p' + str(percentile)] = 1000 * found[min(len(found) - 1, len(found) * percentile // 100)]
+        else:
+            ret['p' + str(percentile)] = 0.0
     
     return ret
 
-def sample_pairs(cases, size):
+def setup(state):
     """
-    Returns (size) random pairs.
+    Sets up a worker process with the parent's global META variable.
     
     Key arguments:
-    cases -- the set of cases.
-    size  -- the number of samples to return.
+    state -- the parent's META variable.
     """
-    ret = []
-    l = len(cases) - 1
+    meta.update(state)
+
+def stream(f, out, models):
+    """
+    Scores cases as they are read, writing a line for each case.
     
-    i = 0
-    while i < size:
-        index1 = random.randint(0, l)
-        index2 = random.randint(0, l)
+    Each line holds the case's position, then its score and the (model
+    file) line numbers of the rules it violates for each model, separated
+    by tabs.
+    
+    Key arguments:
+    f      -- the testing file handle.
+    out    -- the output file handle.
+    models -- the rules of each model to check against.
+    """
+    if profile != None:
+        profile.start('score')
+    
+    rules, starts = merge(models)
+    scorer = Scorer(rules, starts)
+    
+    # Rules fired (violated) in all.
+    fired = 0
+    
+    for line in f:
+        case = parse(line)
         
-        # We don't want an instance to compare to itself.
-        if index1 == index2:
+        # Skip blank lines.
+        if case == None:
             continue
         
-        ret.append((cases[index1], cases[index2]))
-        i += 1
+        values, violated, _ = scorer.split(case)
+        
+        line = str(scorer.i)
+        for k in range(len(models)):
+            fired += len(violated[k])
+            line += "\t" + str(values[k]) + "\t" + ",".join([str(r + 1) for r in violated[k]])
+        
+        out.write(line + "\n")
+        out.flush()
     
-    return ret
+    if profile != None:
+        profile.count('scored', scorer.i)
+        profile.count('fired', fired)
+
+def tally(cases):
+    """
+    Returns the number of cases with each code, for every attribute.
+    
+    Key arguments:
+    cases -- the cases.
+    """
+    return [collections.Counter(column) for column in cases.columns]
+
+def typecode(size):
+    """
+    Returns the smallest array typecode that can hold an attribute's codes.
+    
+    Key arguments:
+    size -- the number of values the attribute has.
+    """
+    if size < 0xFF:
+        return 'B'
+    
+    if size < 0xFFFF:
+        return 'H'
+    
+    return 'I'
+
+def unseen(attr):
+    """
+    Returns the code of a value that is not listed for an attribute in the
+    attribute file, which is one past the last listed value.  Rules never
+    allow it, so it is always a violation of a rule's consequent.
+    
+    Key arguments:
+    attr -- the attribute index.
+    """
+    return len(meta['values'][attr]) + 1
+
+def update(path, rules, tallies, size):
+    """
+    Updates rules with the cases of a new training file.
+    
+    The new cases go through training pass 2, so the rules bind to more
+    cases and allow the new consequent values.  When -P is given, the
+    first P of the new cases are used for validation instead, and the
+    rules they violate are retired.
+    
+    Key arguments:
+    path    -- the new training file location.
+    rules   -- the RuleSet.
+    tallies -- the tallies of the training cases so far.
+    size    -- the number of cases read at a time.
+    """
+    if size < 1:
+        raise ValueError("Chunk size must be at least one case.")
+    
+    # Number of validation cases, which come first.
+    num = 0
+    if 'P' in meta['opts']:
+        if profile != None:
+            profile.start('count')
+        f = open(path, 'r')
+        length = 0
+        for line in lines(f):
+            length += 1
+        f.close()
+        
+        num = int(meta['opts']['P'] * length)
+    
+    learn_rest(path, num, {}, rules, tallies, size)
 
 def usage():
     """Prints the usage of the program."""
     print("\n" + 
           "The following are arguments required:\n" + 
-          "-e: the execution method (learn|predict)\n" + 
+          "-e: the execution method (learn|predict|roc|stream|serve|update|convert)\n" + 
           "-a: the attribute file location.\n" + 
-          "-t: the training/testing file location.\n" + 
-          "-m: the model file (machine readable results).\n" + 
-          "-o: the output file (human readable results).\n\n" + 
+          "-t: the training/testing file location (- for standard input\n" + 
+          "    during the 'stream' phase, not used by the 'convert' and\n" + 
+          "    'serve' phases).\n" + 
+          "-m: the model file (machine readable results), or a comma\n" + 
+          "    separated list of model files to score the cases against\n" + 
+          "    during the 'predict' and 'stream' phases.\n" + 
+          "-o: the output file (human readable results, - for standard\n" + 
+          "    output during the 'stream' phase, the binary model file\n" + 
+          "    during the 'convert' phase, the socket during the 'serve'\n" + 
+          "    phase).\n\n" + 
           "The following arguments are required during the 'learn' phase:\n"
           "-L: the number of pairs of examples for generating candidate rules.\n" +
           "-M: the maximum number of rules per pair of examples.\n" + 
@@ -564,7 +3468,36 @@ def usage():
           "The following arguments are required during the 'predict' phase:\n" + 
           "-T: the threshold.\n" + 
           "-N: the attribute that is \"normal\".\n" +
-          "-V: the value of the attribute that is \"normal\".\n" + 
+          "-V: the value of the attribute that is \"normal\".\n\n" + 
+          "The 'roc' phase requires -N and -V, and finds the detection rate\n" + 
+          "and false alarm rate at every threshold.\n\n" + 
+          "The 'update' phase updates the rules of a model file (-m) with\n" + 
+          "new training cases, and writes the model file again.  The first\n" + 
+          "P of the new cases validate the rules when -P is given.\n\n" + 
+          "The 'serve' phase scores the cases sent to a Unix socket (-o)\n" + 
+          "one per line, and answers each with a line as 'stream' writes.\n\n" + 
+          "The 'convert' phase writes a text model file (-m) from an earlier\n" + 
+          "version as a binary model file (-o).\n\n" + 
+          "The following arguments are optional:\n" + 
+          "-R: use the reference paths: check rules case by case instead of\n" + 
+          "    evaluating them against all the cases at once, and compare\n" + 
+          "    every pair of rules in the coverage test.\n" + 
+          "-K: the rule matching method during the 'predict' phase, either\n" + 
+          "    trie (walk the rules arranged by shared terms, the default),\n" + 
+          "    index (look up the rules each case can bind to) or mask\n" + 
+          "    (evaluate each rule against all the cases at once).\n" + 
+          "-W: the number of worker processes that generate candidate rules\n" + 
+          "    during the 'learn' phase (1 by default), with the same rules\n" + 
+          "    as one process.  During the 'predict' and 'roc' phases, each\n" + 
+          "    worker scores the cases against a shard of the rules at once,\n" + 
+          "    with the same scores.\n" + 
+          "    The workers also parse the training/testing file in blocks.\n" + 
+          "-I: write the time and allocation peak of each phase of the run,\n" + 
+          "    and operation counters, as JSON to the output file location\n" + 
+          "    followed by .profile.json.\n" + 
+          "-C: the number of cases to read at a time during the 'learn'\n" + 
+          "    phase, reading the training file again for each pass instead\n" + 
+          "    of holding all of its cases, and the 'update' phase.\n" + 
           "\n" + 
           "Example Usage:\n" + 
           "python lerad.py -e learn -a \"../data/toy-attr.txt\"" + 
@@ -574,6 +3507,20 @@ def usage():
           "python lerad.py -e predict -a \"../data/toy-attr.txt\"" + 
           " -t \"../data/toy-test.txt\" -m \"toy-model.dat\"" + 
           " -o \"test-results.txt\" -T 10.0 -N toy -V yes" + 
+          "\n" + 
+          "python lerad.py -e roc -a \"../data/toy-attr.txt\"" + 
+          " -t \"../data/toy-test.txt\" -m \"toy-model.dat\"" + 
+          " -o \"test-roc.txt\" -N toy -V yes" + 
+          "\n" + 
+          "python lerad.py -e convert -a \"../data/toy-attr.txt\"" + 
+          " -m \"toy-model.dat\" -o \"toy-model.bin\"" + 
+          "\n" + 
+          "python lerad.py -e update -a \"../data/toy-attr.txt\"" + 
+          " -t \"../data/toy-new.txt\" -m \"toy-model.dat\"" + 
+          " -o \"toy-model.txt\" -P .1" + 
+          "\n" + 
+          "python lerad.py -e stream -a \"../data/toy-attr.txt\"" + 
+          " -t - -m \"toy-model.dat\" -o -" + 
           "\n")
 
 def validate_rules(cases, rules):
@@ -582,20 +3529,25 @@ def validate_rules(cases, rules):
     
     Key arguments:
     cases -- the validation cases.
-    rules -- the rules to reduce.
+    rules -- the RuleSet to reduce.
     """
-    new_rules = []
-    for rule in rules:
-        found = True
-        for case in cases:
-            if rule.binds(case):
-                if not case[rule.consequent[0]] in rule.consequent[1]:
-                    found = False
-                    break
-        if found:
-            new_rules.append(rule)
+    kept = []
+    for r, (_, _, violations) in enumerate(kernel(cases, rules)):
+        # Keep the rule if no case violates its consequent.
+        if not violations:
+            kept.append(r)
     
-    rules = new_rules
+    if profile != None:
+        profile.count('rejected', len(rules) - len(kept))
+    
+    rules.keep(kept)
+
+def vocabulary():
+    """
+    Returns the SHA-256 digest of every attribute's values, in order,
+    which the codes of cache files and binary model files stand for.
+    """
+    return hashlib.sha256(repr([meta['values'][attr] for attr in range(len(meta['values']))]).encode()).digest()
 
 """Main execution."""
 if __name__ == "__main__":
@@ -1,52 +1,223 @@
 """
 Generates the reports data.
 
+The experiments run in-process on top of lerad.learn() and lerad.scores(),
+spread over a pool of worker processes.
+
 @author Aaron Zampaglione <azampagl@my.fit.edu>
 @course CSE 5800 Advanced Topics in CS: Learning/Mining and the Internet, Fall 2011
 @project Proj 02, LERAD
 """
-import commands
+import multiprocessing
 import random
+import time
+import unittest
+
+import contaminate
+import lerad
+import test_lerad
 
 random.seed(23)
 
+#
+# Encoded cases each process has loaded, keyed by file location.
+#
+cache = {}
+
 def main():
     """Main execution method."""
     create_attack()
     robust()
 
 def create_attack():
+    """
+    Writes the contaminated training files of the robustness study, with
+    0 to 10 percent attacks (see contaminate.contaminate()).
+    """
+    contaminate.contaminate("../data/ids-train.txt", "../data/ids-attack.txt", [str(i) for i in range(11)], "../data/robust/train-", 23)
+
+def check():
+    """
+    Runs the tests of test_lerad, which check that the fast paths keep the
+    same rules as the reference paths on the bundled datasets.
+    
+    Returns whether every test passed.
+    """
+    suite = unittest.defaultTestLoader.loadTestsFromModule(test_lerad)
+    
+    return unittest.TextTestRunner().run(suite).wasSuccessful()
+
+def dataset(path):
+    """
+    Returns the encoded cases of a file, loading them once per process.
+    
+    Key arguments:
+    path -- the training/testing file location.
+    """
+    if not path in cache:
+        cache[path] = lerad.cached(path)
+    
+    return cache[path]
+
+def experiment(config):
+    """
+    Learns a model for one configuration and scores the test set with it.
+    
+    Returns the configuration along with the area under the ROC curve
+    (auc), the detection rate (dr) and false alarm rate (fa) at the
+    threshold, the number of rules and the learn and score times.
+    
+    Key arguments:
+    config -- dictionary of the training file location (train), the S, L,
+              M and P learning options, the random seed (seed) and the
+              threshold (T).
+    """
+    for opt in ['S', 'L', 'M', 'P']:
+        lerad.meta['opts'][opt] = config[opt]
+    
+    random.seed(config['seed'])
+    
+    train = dataset(config['train'])
+    test = dataset(lerad.meta['opts']['t'])
+    
+    start = time.time()
+    rules = lerad.learn(train)
+    learned = time.time()
+    values, _, _ = lerad.scores(test, rules)
+    scored = time.time()
+    
+    _, auc = lerad.curve(test, values)
+    results = lerad.evaluate(test, values, config['T'])
+    
+    result = dict(config)
+    result['auc'] = auc
+    result['dr'] = results['dr']
+    result['fa'] = results['fa']
+    result['rules'] = len(rules)
+    result['learn'] = learned - start
+    result['score'] = scored - learned
+    
+    return result
+
+def model(config):
+    """
+    Learns the model of one configuration.
     
-    f1 = open("../data/ids-train.txt", 'r')
-    f2 = open("../data/ids-attack.txt", 'r')
+    Returns the RuleSet of the rules.
     
-    train = []
-    for line in f1:
-        train.append(line)
+    Key arguments:
+    config -- the configuration (see experiment()).
+    """
+    for opt in ['S', 'L', 'M', 'P']:
+        lerad.meta['opts'][opt] = config[opt]
     
-    attacks = []
-    for line in f2:
-        attacks.append(line)
+    random.seed(config['seed'])
     
-    f1.close()
-    f2.close()
+    return lerad.learn(dataset(config['train']))
+
+def experiments(configs, attr, test, n, v, processes=None, shared=False):
+    """
+    Runs the experiment of each configuration in a pool of processes.
+    
+    Returns the results of experiment(), in the order of the configurations.
+    
+    Key arguments:
+    configs   -- the configurations (see experiment()).
+    attr      -- the attribute file location.
+    test      -- the testing file location.
+    n         -- the attribute that is "normal".
+    v         -- the value of the attribute that is "normal".
+    processes -- [optional] the number of processes (default every core).
+    shared    -- [optional] whether configurations that only differ in L
+                 and M share their candidate rules (see sweep()).
+    """
+    pool = multiprocessing.Pool(processes, setup, (attr, test, n, v))
+    
+    try:
+        if shared:
+            # Group the configurations that can share candidates.
+            groups = {}
+            for i, config in enumerate(configs):
+                k = (config['train'], config['S'], config['P'], config['seed'], config['T'])
+                groups.setdefault(k, []).append(i)
+            
+            results = [None] * len(configs)
+            for indices, found in zip(groups.values(), pool.map(sweep, [[configs[i] for i in indices] for indices in groups.values()], 1)):
+                for i, result in zip(indices, found):
+                    results[i] = result
+        else:
+            results = pool.map(experiment, configs, 1)
+    finally:
+        pool.close()
+        pool.join()
+    
+    return results
+
+def setup(attr, test, n, v):
+    """
+    Loads the attribute file and the test set into a process.
+    
+    Key arguments:
+    attr -- the attribute file location.
+    test -- the testing file location.
+    n    -- the attribute that is "normal".
+    v    -- the value of the attribute that is "normal".
+    """
+    f = open(attr, 'r')
+    lerad.meta['attrs'], lerad.meta['values'] = lerad.attrs(f)
+    f.close()
+    lerad.meta['codes'] = lerad.codes(lerad.meta['values'])
+    
+    lerad.meta['opts']['t'] = test
+    lerad.meta['opts']['N'] = n
+    lerad.meta['opts']['V'] = v
     
-    start = 0.0
-    stop = 0.1
-    inc = 0.01
-    i = start
-    while i <= stop:
-        l = int(len(attacks) * i)
+    dataset(test)
+
+def sweep(configs):
+    """
+    Learns the models of configurations that only differ in L and M from
+    one set of candidate rules (see lerad.learn_sweep()), and scores the
+    test set with each.
+    
+    Returns the results of experiment() for each configuration.  The learn
+    time is the time of the whole sweep.
+    
+    Key arguments:
+    configs -- the configurations (see experiment()).
+    """
+    for opt in ['S', 'P']:
+        lerad.meta['opts'][opt] = configs[0][opt]
+    
+    random.seed(configs[0]['seed'])
+    
+    train = dataset(configs[0]['train'])
+    test = dataset(lerad.meta['opts']['t'])
+    
+    begin = time.time()
+    models = lerad.learn_sweep(train, [(config['L'], config['M']) for config in configs])
+    learned = time.time()
+    
+    results = []
+    for config, rules in zip(configs, models):
+        start = time.time()
+        values, _, _ = lerad.scores(test, rules)
+        scored = time.time()
         
-        new_train = list(train)
-        while len(new_train) < len(train) + l:
-            new_train.insert(random.randint(0, len(new_train) - 1), attacks[random.randint(0, len(attacks) - 1)])
+        _, auc = lerad.curve(test, values)
+        found = lerad.evaluate(test, values, config['T'])
         
-        out = open("../data/robust/train-" + str(int(i * 100)) + ".txt", 'w')
-        for item in new_train:
-            out.write(item)
-        out.close()
-        i += inc
+        result = dict(config)
+        result['auc'] = auc
+        result['dr'] = found['dr']
+        result['fa'] = found['fa']
+        result['rules'] = len(rules)
+        result['learn'] = learned - begin
+        result['score'] = scored - start
+        
+        results.append(result)
+    
+    return results
 
 def robust():
     d = "ids"
@@ -56,88 +227,46 @@ def robust():
     l = 1000
     m = 4
     p = .1
+    t = 1
     
     attr = "../data/" + d + "-attr.txt"
+    test = "../data/" + d + "-test.txt"
     
+    configs = []
     for i in range(11):
-        
-        train = "../data/robust/train-" + str(i) + ".txt"
-        model = "../results/robust/model-" + str(i) + ".dat"
-        output = "../results/robust/model-" + str(i) + ".txt"
-        
-        cmd = "python lerad.py" + \
-              " -e learn " + \
-              " -a " + attr + \
-              " -t " + train + \
-              " -m " + model + \
-              " -o " + output + \
-              " -S " + str(s) + \
-              " -L " + str(l) + \
-              " -M " + str(m) + \
-              " -P " + str(p)
-              
-        commands.getstatusoutput(cmd)
-    
-        responses = []
-    
-        inc = 100
-        start = 0
-        stop = 10000
-        for j in range(start, stop, inc):
-        
-            test = "../data/" + d + "-test.txt"
-            output = "../results/robust/results-" + str(i) + "-" + str(j) + ".txt"
-        
-            cmd = "python lerad.py" + \
-                  " -e predict " + \
-                  " -a " + attr + \
-                  " -t " + test + \
-                  " -m " + model + \
-                  " -o " + output + \
-                  " -T " + str(j) + \
-                  " -N " + n + \
-                  " -V " + v
-        
-            _, response = commands.getstatusoutput(cmd)
-        
-            response = str(i) + "\t" + str(j) + "\t" + response
-            response = response.split("\t")
-        
-            if responses:
-                last_response = responses.pop()
-                responses.append(last_response)
-            else:
-                last_response = [None]
-        
-            if response[2:] != last_response[2:]:
-                #print(response)
-                
-                #print(response)
-                #print(last_response)
-                if float(response[-1]) == 0.0:
-                    if float(last_response[-1]) != 0.0:
-                        rise = (float(last_response[-2]) - float(response[-2])) / 100
-                        run = float(last_response[-1]) / 100
-                        slope = rise / run
-                        # AUC = slope * 1 + detection rate at first point
-                        #print("slope: " + str(slope))
-                        auc = (float(response[-2]) / 100) + (slope * .1)
-                    else:
-                        auc = float(last_response[-2]) / 100
-                    
-                    print(str(i) + "\t" + str(auc))
-                    
-                    break
-                responses.append(response)
-        
-        #for response in responses:      
-        #    print("\t".join(response))
+        configs.append({'train': "../data/robust/train-" + str(i) + ".txt",
+                        'S': s,
+                        'L': l,
+                        'M': m,
+                        'P': p,
+                        'seed': 23,
+                        'T': t,
+                        })
+    
+    # Learn the models in parallel, then score the test set against all
+    #  of them in one pass.
+    pool = multiprocessing.Pool(None, setup, (attr, test, n, v))
+    
+    try:
+        models = pool.map(model, configs, 1)
+    finally:
+        pool.close()
+        pool.join()
+    
+    setup(attr, test, n, v)
+    
+    i = 0
+    for values, _, _ in lerad.scores_models(dataset(test), models):
+        _, area = lerad.curve(dataset(test), values)
+        print(str(i) + "\t" + str(area))
+        i += 1
 
 def sens():
     
     d = "ids"
     n = "class"
     v = "normal"
+    t = 1
     
     vars = {
             's': {'start': 50,
@@ -169,85 +298,35 @@ def sens():
     attr = "../data/" + d + "-attr.txt"
     train = "../data/" + d + "-train.txt"
     test = "../data/" + d + "-test.txt"
-    model = "../results/" + d + "-model.dat"
-    output = "../results/" + d + "-model.txt"
 
     for var, settings in vars.items():
         print(var)
+        
+        # Every value of this variable, with the others at their best.
+        configs = []
         i = settings['start']
-        best_auc = None
         while i < settings['stop']:
+            config = {'train': train, 'seed': 23, 'T': t}
+            for other in vars:
+                config[other.upper()] = vars[other]['curr']
+            config[var.upper()] = i
+            configs.append(config)
             
-            vars[var]['curr'] = i
-            
-            model = "../results/sensitivity/" + var + "-" + str(i) + "-model.dat"
-            output = "../results/sensitivity/" + var + "-" + str(i) + "-model.txt"
-            
-            cmd = "python lerad.py" + \
-              " -e learn " + \
-              " -a " + attr + \
-              " -t " + train + \
-              " -m " + model + \
-              " -o " + output + \
-              " -S " + str(vars['s']['curr']) + \
-              " -L " + str(vars['l']['curr']) + \
-              " -M " + str(vars['m']['curr']) + \
-              " -P " + str(vars['p']['curr'])
-            
-            commands.getstatusoutput(cmd)
-            responses = []
+            i += settings['inc']
+        
+        best_auc = None
+        # Only S and P need new candidate rules, the L and M runs share
+        #  them.
+        for result in experiments(configs, attr, test, n, v, shared=True):
+            i = result[var.upper()]
+            auc = result['auc']
             
+            if auc != "NaN" and (best_auc == None or auc > best_auc):
+                best_auc = auc
+                vars[var]['best'] = i
             
-            for j in range(0, 10000, 100):
-                
-                #if len(responses) > 2:
-                #    break
-                
-                output = "../results/sensitivity/" + var + "-" + str(i) + "-" + str(j) + "-results.txt"
-                
-                cmd = "python lerad.py" + \
-                  " -e predict " + \
-                  " -a " + attr + \
-                  " -t " + test + \
-                  " -m " + model + \
-                  " -o " + output + \
-                  " -T " + str(j) + \
-                  " -N " + n + \
-                  " -V " + v
+            print(str(i) + "\t" + str(auc))
         
-                _, response = commands.getstatusoutput(cmd)
-        
-                response = str(i) + "\t" +str(j) + "\t" + response
-                response = response.split("\t")
-                
-                if responses:
-                    last_response = responses.pop()
-                    responses.append(last_response)
-                else:
-                    last_response = [None]
-                
-                if response[2:] != last_response[2:]:
-                    #print(response)
-                    if float(response[-1]) == 0.0:
-                        if float(last_response[-1]) != 0.0:
-                            rise = (float(last_response[-2]) - float(response[-2])) / 100
-                            run = float(last_response[-1]) / 100
-                            slope = rise / run
-                            # AUC = slope * 1 + detection rate at first point
-                            #print("slope: " + str(slope))
-                            auc = (float(response[-2]) / 100) + (slope * .1)
-                        else:
-                            auc = float(last_response[-2]) / 100
-                        
-                        if auc > best_auc:
-                            best_auc = auc
-                            vars[var]['best'] = i
-                        
-                        print(str(response[0]) + "\t" + str(auc))
-                        break
-                    responses.append(response)
-                 
-            i += settings['inc']
         vars[var]['curr'] = vars[var]['best']
         print("**" + str(vars[var]['curr']) + "**")
 
@@ -275,59 +354,25 @@ def auc():
     
     attr = "../data/" + d + "-attr.txt"
     train = "../data/" + d + "-train.txt"
-    model = "../results/" + d + "-model.dat"
-    output = "../results/" + d + "-model.txt"
-    
-    cmd = "python lerad.py" + \
-          " -e learn " + \
-          " -a " + attr + \
-          " -t " + train + \
-          " -m " + model + \
-          " -o " + output + \
-          " -S " + str(s) + \
-          " -L " + str(l) + \
-          " -M " + str(m) + \
-          " -P .1"
-              
-    commands.getstatusoutput(cmd)
-    
-    responses = []
-
-    inc = 1
-    start = 0
-    stop = 1000
-    for i in range(start, stop, inc):
-        
-        test = "../data/" + d + "-test.txt"
-        output = "../results/" + d + "-results.txt"
-        
-        cmd = "python lerad.py" + \
-              " -e predict " + \
-              " -a " + attr + \
-              " -t " + test + \
-              " -m " + model + \
-              " -o " + output + \
-              " -T " + str(i) + \
-              " -N " + n + \
-              " -V " + v
-        
-        _, response = commands.getstatusoutput(cmd)
-        
-        response = str(i) + "\t" + response
-        response = response.split("\t")
-        
-        if responses:
-            last_response = responses.pop()
-            responses.append(last_response)
-        else:
-            last_response = [None]
-        
-        if response[1:] != last_response[1:]:
-            print(response)
-            responses.append(response)
+    test = "../data/" + d + "-test.txt"
+    
+    setup(attr, test, n, v)
+    
+    lerad.meta['opts']['S'] = s
+    lerad.meta['opts']['L'] = l
+    lerad.meta['opts']['M'] = m
+    lerad.meta['opts']['P'] = .1
+    
+    rules = lerad.learn(dataset(train))
+    
+    # Score the test set once for the whole ROC curve.
+    values, _, _ = lerad.scores(dataset(test), rules)
+    points, area = lerad.curve(dataset(test), values)
+    
+    for threshold, dr, fa in points:
+        print(str(threshold) + "\t" + str(dr) + "\t" + str(fa))
     
-    for response in responses:      
-        print("\t".join(response))
+    print("AUC: " + str(area))
 
 """Main execution."""
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+"""
+Tests that the fast paths of LERAD keep the same rules as the reference
+paths.
+
+The coverage test (remove_rules()) is checked against the all pairs
+coverage test (remove_rules_reference()) on the candidate rules of the
+bundled datasets and on random candidate sets, and learning is checked
+against learning with the reference paths (-R).
+
+Run from the src directory:
+
+> python -m unittest test_lerad
+"""
+import random
+import unittest
+
+import lerad
+
+#
+# Bundled datasets: name, training file, normal attribute, normal value,
+#  and the S, L, M and P options to learn with.
+#
+DATASETS = [("toy", "../data/toy-train.txt", "toy", "yes", 6, 10, 5, .1),
+            ("iris", "../data/iris-train.txt", "class", "Iris-setosa", 30, 20, 10, .1),
+            ("ids", "../data/ids-train.txt", "class", "normal", 100, 1000, 4, .1),
+            ] + [("ids", "../data/robust/train-" + str(i) + ".txt", "class", "normal", 100, 1000, 4, .1) for i in range(11)]
+
+def load(name, n, v):
+    """
+    Loads a bundled dataset's attribute file.
+    
+    Key arguments:
+    name -- the dataset name.
+    n    -- the attribute that is "normal".
+    v    -- the value of the attribute that is "normal".
+    """
+    f = open("../data/" + name + "-attr.txt", 'r')
+    lerad.meta['attrs'], lerad.meta['values'] = lerad.attrs(f)
+    f.close()
+    lerad.meta['codes'] = lerad.codes(lerad.meta['values'])
+    
+    lerad.meta['opts'] = {'N': n, 'V': v}
+
+def saved(rules):
+    """
+    Returns the saved form of every rule of a RuleSet, in order.
+    
+    Key arguments:
+    rules -- the RuleSet.
+    """
+    return [rule.save() for rule in rules]
+
+class CoverageTest(unittest.TestCase):
+    """
+    remove_rules() keeps the same rules as remove_rules_reference().
+    """
+    
+    def assertSameCoverage(self, rules):
+        """
+        Asserts that both coverage tests keep the same rules of a RuleSet.
+        
+        Key arguments:
+        rules -- the RuleSet of the candidate rules.
+        """
+        fast = rules.take(range(len(rules)))
+        reference = rules.take(range(len(rules)))
+        
+        lerad.remove_rules(fast)
+        lerad.remove_rules_reference(reference)
+        
+        self.assertEqual(saved(fast), saved(reference))
+    
+    def test_datasets(self):
+        for name, train, n, v, s, l, m, p in DATASETS:
+            with self.subTest(train=train):
+                load(name, n, v)
+                lerad.meta['opts']['M'] = m
+                
+                random.seed(23)
+                cases = lerad.scan(train)
+                subset = cases.take(lerad.sample_subset(range(len(cases)), s))
+                pairs = lerad.sample_pairs(subset, l * 2)
+                
+                self.assertSameCoverage(lerad.generate_candidates((subset, pairs)))
+    
+    def test_random(self):
+        # Short antecedents over a few values share many parts, so most
+        #  rules look their parts up.  Long ones with few rules kept are
+        #  compared to every kept rule instead.
+        lerad.meta['attrs'] = dict([(attr, "a" + str(attr)) for attr in range(20)])
+        lerad.meta['values'] = dict([(attr, ["x", "y", "z"]) for attr in range(20)])
+        lerad.meta['codes'] = lerad.codes(lerad.meta['values'])
+        lerad.meta['opts'] = {}
+        
+        rnd = random.Random(23)
+        for trial in range(50):
+            with self.subTest(trial=trial):
+                if trial % 2 == 0:
+                    attrs, values, sizes, count = 8, 2, (1, 4), 300
+                else:
+                    attrs, values, sizes, count = 16, 2, (5, 12), 40
+                
+                rules = []
+                for _ in range(count):
+                    rule = lerad.Rule()
+                    for attr in rnd.sample(range(attrs), rnd.randint(*sizes)):
+                        rule.antecedent[attr] = rnd.randint(1, values)
+                    rule.consequent = attrs + rnd.randrange(4)
+                    for code in rnd.sample(range(1, 4), rnd.randint(1, 3)):
+                        rule.allow(code)
+                    rule.bindings = rnd.randint(1, 20)
+                    rules.append(rule)
+                
+                self.assertSameCoverage(lerad.ruleset(rules))
+
+class LearnTest(unittest.TestCase):
+    """
+    learn() gives the same rules as learning with the reference paths
+    (case by case binding, all pairs coverage test).
+    """
+    
+    def test_datasets(self):
+        for name, train, n, v, s, l, m, p in DATASETS:
+            with self.subTest(train=train):
+                load(name, n, v)
+                lerad.meta['opts'].update({'S': s, 'L': l, 'M': m, 'P': p})
+                cases = lerad.scan(train)
+                
+                random.seed(23)
+                fast = lerad.learn(cases)
+                
+                lerad.meta['opts']['R'] = ''
+                random.seed(23)
+                reference = lerad.learn(cases)
+                
+                self.assertEqual(saved(fast), saved(reference))
+
+"""Main execution."""
+if __name__ == "__main__":
+    unittest.main()